@@ -0,0 +1,543 @@
+import argparse
+import gzip
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+
+import lista
+
+# Benchmarks of the EPG/playlist stages of lista.py (offline, synthetic data)
+# Example: python scripts/benchmark.py gzip --size-mb 50 --level 9 --threads 4
+# Stage suite: python scripts/benchmark.py suite --output results.json --compare previous.json
+
+WORDS = ("calcio serie film notizie meteo documentario cucina viaggio musica quiz "
+         "telegiornale commedia dramma avventura storia scienza natura sport").split()
+
+def generate_xmltv(size_mb=50, programmes_per_channel=200, seed=1, channels=None):
+    """
+    Synthetic XMLTV document: `channels` channels with a block of programmes each,
+    or as many channels as needed to reach about size_mb MB.
+    """
+    rng = random.Random(seed)
+    words = WORDS
+    start_time = datetime(2025, 10, 20, 6, 0, tzinfo=timezone.utc)
+    target = size_mb * 1024 * 1024
+
+    out = io.BytesIO()
+    out.write(lista.EPG_XML_HEADER)
+    channel = 0
+    while (channel < channels) if channels is not None else (out.tell() < target):
+        channel_id = f"Channel {channel}.it"
+        out.write(f'<channel id="{channel_id}"><display-name>Channel {channel} HD</display-name>'
+                  f'<icon src="https://example.com/logos/{channel}.png" /></channel>\n'.encode("utf-8"))
+        current = start_time
+        for _ in range(programmes_per_channel):
+            stop = current + timedelta(minutes=rng.choice((15, 30, 45, 60, 90, 120)))
+            title = " ".join(rng.choice(words) for _ in range(rng.randint(2, 5))).title()
+            desc = " ".join(rng.choice(words) for _ in range(rng.randint(10, 60)))
+            out.write(f'<programme start="{current:%Y%m%d%H%M%S} +0000" stop="{stop:%Y%m%d%H%M%S} +0000" '
+                      f'channel="{channel_id}"><title lang="it">{title}</title>'
+                      f'<desc lang="it">{desc}</desc></programme>\n'.encode("utf-8"))
+            current = stop
+        channel += 1
+    out.write(lista.EPG_XML_FOOTER)
+    return out.getvalue()
+
+def generate_m3u_entries(count, seed=1):
+    """Synthetic playlist entries (EXTINF line, EXTVLCOPT lines, URL), as written by save_as_m3u."""
+    rng = random.Random(seed)
+    categories = ("Sport", "Film & Serie TV", "Intrattenimento", "News", "Bambini", "Documentari", "Musica", "Altro")
+    entries = []
+    for number in range(count):
+        name = f"{' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).upper()} {number}"
+        category = rng.choice(categories)
+        extinf = (f'#EXTINF:-1 tvg-id="channel{number}.it" tvg-logo="https://example.com/logos/{number}.png" '
+                  f'group-title="{category}",{name}')
+        options = [f"#EXTVLCOPT:http-user-agent=Mozilla/5.0 (Benchmark {number})",
+                   f"#EXTVLCOPT:http-referrer=https://example.com/{number % 7}/",
+                   f"#EXTVLCOPT:http-origin=https://example.com"][:rng.randint(0, 3)]
+        entries.append((name, category, [extinf] + options + [f"https://streams.example.com/{number}/index.m3u8"]))
+    return entries
+
+def read_m3u_entries(path):
+    """Entries of an existing playlist (e.g. the committed lista.m3u), in the generator's format."""
+    entries = []
+    block = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                block = [line]
+            elif block is not None and line and not line.startswith('#EXTM3U'):
+                block.append(line)
+                if not line.startswith('#'):
+                    name = block[0].split(',', 1)[-1].strip()
+                    category = block[0].split('group-title="', 1)[-1].split('"', 1)[0] if 'group-title="' in block[0] else "Altro"
+                    entries.append((name, category, block))
+                    block = None
+    return entries
+
+def write_chunks(writer, data, chunk_size=4096):
+    """Feeds data to a writer in element-sized chunks, like the EPG tee writer does."""
+    view = memoryview(data)
+    for offset in range(0, len(data), chunk_size):
+        writer.write(view[offset:offset + chunk_size])
+    writer.close()
+
+def benchmark_gzip(data, level, threads):
+    results = []
+
+    raw = io.BytesIO()
+    started = time.perf_counter()
+    write_chunks(gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level, mtime=0), data)
+    results.append(("GzipFile", time.perf_counter() - started, raw.getvalue()))
+
+    raw = io.BytesIO()
+    started = time.perf_counter()
+    write_chunks(lista.ParallelGzipWriter(raw, level, threads), data)
+    results.append((f"ParallelGzipWriter x{threads or os.cpu_count()}", time.perf_counter() - started, raw.getvalue()))
+
+    print(f"Input: {len(data) / (1024 * 1024):.1f} MB, level {level}")
+    baseline = results[0][1]
+    for name, elapsed, compressed in results:
+        assert gzip.decompress(compressed) == data, f"{name}: output does not round-trip"
+        print(f"  {name:<28} {elapsed:7.2f}s  {len(compressed) / (1024 * 1024):6.2f} MB  x{baseline / elapsed:.2f}")
+
+def merge_with(reader, path):
+    """Runs the merge loop of epg_merger (read + serialize, no filters) and returns the output document."""
+    out = io.BytesIO()
+    out.write(lista.EPG_XML_HEADER)
+    for element in reader(path):
+        out.write(lista.serialize_epg_element(element))
+    out.write(lista.EPG_XML_FOOTER)
+    return out.getvalue()
+
+def load_fixture(file, size_mb):
+    """Bytes of an XMLTV fixture: the given .xml/.xml.gz file, or a synthetic document."""
+    if not file:
+        return generate_xmltv(size_mb)
+    with open(file, 'rb') as f:
+        data = f.read()
+    return gzip.decompress(data) if data.startswith(lista.GZIP_MAGIC) else data
+
+EPG_ENGINES = {
+    "etree": lista.iter_epg_elements,
+    "lxml": lista.iter_lxml_epg_elements,
+    "splice": lista.iter_spliced_epg_elements,
+}
+
+def benchmark_engines(data, engines):
+    """Times the merge loop with each engine against etree and checks the outputs match."""
+    with tempfile.NamedTemporaryFile(suffix=".xml") as f:
+        f.write(data)
+        f.flush()
+        timings = {}
+        outputs = {}
+        for name in ["etree"] + [engine for engine in engines if engine != "etree"]:
+            started = time.perf_counter()
+            outputs[name] = merge_with(EPG_ENGINES[name], f.name)
+            timings[name] = time.perf_counter() - started
+
+    print(f"Input: {len(data) / (1024 * 1024):.1f} MB")
+    reference = outputs["etree"]
+    failed = False
+    for name, elapsed in timings.items():
+        identical = outputs[name] == reference
+        equivalent = identical or ET.canonicalize(outputs[name].decode("utf-8")) == ET.canonicalize(reference.decode("utf-8"))
+        failed |= not equivalent
+        print(f"  {name:<8} {elapsed:7.2f}s  x{timings['etree'] / elapsed:.2f}  "
+              f"{'byte-identical' if identical else 'canonically equivalent' if equivalent else 'DIFFERENT'}")
+    if failed:
+        raise SystemExit(1)
+
+def legacy_parse_m3u_for_sorting(file_path):
+    """The parser merger_playlist/merger_playlistworld used before iter_m3u_entries (reference for the m3u benchmark)."""
+    import re
+
+    channels = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        if line.startswith('#EXTINF:'):
+            channel_name_match = re.search(r',(.+)', line)
+            channel_name = channel_name_match.group(1).strip() if channel_name_match else "NoName"
+            channel_block = [line]
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith('#EXTINF:'):
+                channel_block.append(lines[i].strip())
+                i += 1
+            channels.append((channel_name, channel_block))
+        else:
+            i += 1
+    return channels
+
+def benchmark_m3u(path, repeat):
+    """Micro-benchmark of the M3U tokenizer against the legacy parser on a playlist."""
+    timings = {}
+    counts = {}
+    for name, parse in (("legacy", legacy_parse_m3u_for_sorting), ("iter_m3u_entries", lista.read_m3u_entries)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            counts[name] = len(parse(path))
+        timings[name] = (time.perf_counter() - started) / repeat
+
+    print(f"Input: {path} ({os.path.getsize(path) / 1024:.0f} KB), {repeat} runs")
+    for name, elapsed in timings.items():
+        print(f"  {name:<18} {elapsed * 1000:8.2f} ms  {counts[name]} entries  x{timings['legacy'] / elapsed:.2f}")
+
+# ---------------------------------------------------------------------------
+# Stage suite: every stage runs in its own process on a prepared work directory,
+# with the network replaced by canned responses (routes.json).
+# ---------------------------------------------------------------------------
+
+EPG_FEED_URLS = [
+    'https://www.open-epg.com/files/italy1.xml',
+    'https://www.open-epg.com/files/italy2.xml',
+    'https://www.open-epg.com/files/italy3.xml',
+    'https://www.open-epg.com/files/italy4.xml',
+    'https://epgshare01.online/epgshare01/epg_ripper_IT1.xml.gz',
+]
+EPG_IT_URL = 'https://raw.githubusercontent.com/matthuisman/i.mjh.nz/master/PlutoTV/it.xml'
+PLUTO_URL = "https://raw.githubusercontent.com/Brenders/Pluto-TV-Italia-M3U/main/PlutoItaly.m3u"
+VAVOO_SIGNATURE_URL = "https://vavoo.to/mediahubmx-signature.json"
+VAVOO_CATALOG_URL = "https://vavoo.to/mediahubmx-catalog.json"
+DADDY_CHANNELS_URL = "https://dlhd.dad/24-7-channels.php"
+VAVOO_PAGE_SIZE = 1000
+
+# Stage -> (function name in lista.py, output files)
+STAGES = {
+    "epg_merger": ("epg_merger", ["epg.xml", "epg.xml.gz"]),
+    "merger_playlist": ("merger_playlist", ["lista.m3u"]),
+    "italy_channels": ("italy_channels", ["vavoo.m3u", "dlhd.m3u"]),  # save_as_m3u of vavoo and dlhd
+    "italy_to_lista": ("italy_channels_to_lista", ["vavoo.m3u", "dlhd.m3u", "lista.m3u"]),
+}
+
+def italy_channels_to_lista():
+    """italy_channels handing its entries to merger_playlist in-process, as main() does"""
+    lista.merger_playlist(lista.italy_channels() or {})
+
+# Settings of the stage processes: no time horizon (fixtures are dated) and a cold feed cache
+STAGE_ENVIRONMENT = {"EPG_HORIZON": "no", "CANALI_DADDY": "si", "LINK_DADDY": "https://dlhd.dad"}
+
+class MockResponse:
+    """Canned requests.Response for the offline stage runs."""
+
+    def __init__(self, url, content):
+        import hashlib
+
+        self.url = url
+        self.status_code = 200
+        self.content = content
+        self.encoding = "utf-8"
+        self.headers = {"ETag": hashlib.sha1(content).hexdigest()}
+        self.raw = io.BytesIO(content)
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for offset in range(0, len(self.content), chunk_size):
+            yield self.content[offset:offset + chunk_size]
+
+    def iter_lines(self, chunk_size=512, decode_unicode=False):
+        for line in self.content.splitlines():
+            yield line.decode(self.encoding) if decode_unicode else line
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+def install_network_mock(routes):
+    """Serves GET/POST from the routes of the work directory, any other URL fails like an offline host."""
+    import requests
+
+    def respond(url, json_body=None):
+        if url == VAVOO_CATALOG_URL:
+            items = routes[url]
+            cursor = int((json_body or {}).get("cursor") or 0)
+            page = items[cursor:cursor + VAVOO_PAGE_SIZE]
+            next_cursor = cursor + VAVOO_PAGE_SIZE if cursor + VAVOO_PAGE_SIZE < len(items) else None
+            return MockResponse(url, json.dumps({"items": page, "nextCursor": next_cursor}).encode("utf-8"))
+        if url not in routes:
+            raise requests.exceptions.ConnectionError(f"offline benchmark, no route for {url}")
+        with open(routes[url], 'rb') as f:
+            return MockResponse(url, f.read())
+
+    def get(*args, **kwargs):
+        url = args[1] if args and not isinstance(args[0], str) else (args[0] if args else kwargs["url"])
+        return respond(url)
+
+    def post(*args, **kwargs):
+        url = args[1] if args and not isinstance(args[0], str) else (args[0] if args else kwargs["url"])
+        return respond(url, kwargs.get("json"))
+
+    requests.get = get
+    requests.post = post
+    requests.Session.get = get
+    requests.Session.post = post
+
+def split_epg_feeds(document, feeds_dir):
+    """Distributes the channels of an XMLTV document over the EPG feed files (with some overlap between feeds)."""
+    os.makedirs(feeds_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(suffix=".xml") as f:
+        f.write(document)
+        f.flush()
+        feeds = [[lista.EPG_XML_HEADER] for _ in range(len(EPG_FEED_URLS) + 1)]
+        for element in lista.iter_spliced_epg_elements(f.name):
+            channel_hash = zlib.crc32(element.get(lista.EPG_ID_ATTRIBUTES[element.tag], "").encode("utf-8"))
+            feed = channel_hash % len(EPG_FEED_URLS)
+            feeds[feed].append(element.data)
+            # A quarter of the channels is also published by the next feed, like the real sources do
+            if channel_hash % 4 == 0:
+                feeds[(feed + 1) % len(EPG_FEED_URLS)].append(element.data)
+            # it.xml only contributes programmes
+            if element.tag == "programme" and channel_hash % 10 == 0:
+                feeds[-1].append(element.data)
+
+    routes = {}
+    for url, feed in zip(EPG_FEED_URLS + [EPG_IT_URL], feeds):
+        data = b"".join(feed) + lista.EPG_XML_FOOTER
+        path = os.path.join(feeds_dir, url.rsplit("/", 1)[-1])
+        with open(path, 'wb') as f:
+            f.write(gzip.compress(data, mtime=0) if url.endswith(".gz") else data)
+        routes[url] = path
+    return routes
+
+def write_playlist(path, entries, by_category=False):
+    """Writes entries as an M3U playlist; by_category mimics save_as_m3u (sorted blocks under '# CATEGORY')."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("#EXTM3U\n")
+        if not by_category:
+            for _, _, block in entries:
+                f.write("\n".join(block) + "\n")
+            return
+        categories = {}
+        for entry in entries:
+            categories.setdefault(entry[1], []).append(entry)
+        for category, category_entries in categories.items():
+            f.write(f"\n# {category.upper()}\n")
+            for _, _, block in sorted(category_entries, key=lambda entry: entry[0].lower()):
+                f.write("\n".join(block) + "\n")
+
+def prepare_workdir(workdir, document, entries):
+    """Inputs of every stage: EPG feeds, playlists, Vavoo catalog and Daddylive page, plus routes.json."""
+    os.makedirs(workdir, exist_ok=True)
+    routes = split_epg_feeds(document, os.path.join(workdir, "feeds"))
+
+    # epg.xml as left by epg_merger, read by create_tvg_id_map in italy_channels
+    with open(os.path.join(workdir, "epg.xml"), 'wb') as f:
+        f.write(document)
+
+    # Playlists read by merger_playlist: 50% vavoo, 20% dlhd, 10% mpd, 5% each for the others
+    shares = {"vavoo.m3u": range(0, 10), "dlhd.m3u": range(10, 14), "mpd.m3u": range(14, 16),
+              "eventi_dlhd.m3u": [16], "sportsonline.m3u": [17], "streamed.m3u": [18], "pluto.m3u": [19]}
+    for name, slots in shares.items():
+        selected = [entry for number, entry in enumerate(entries) if number % 20 in slots]
+        write_playlist(os.path.join(workdir, name), selected, by_category=name in ("vavoo.m3u", "dlhd.m3u", "mpd.m3u"))
+    routes[PLUTO_URL] = os.path.join(workdir, "pluto.m3u")
+
+    # Vavoo catalog (paginated by install_network_mock) and the Daddylive 24/7 page
+    routes[VAVOO_CATALOG_URL] = [{"name": name, "url": block[-1]} for name, _, block in entries]
+    signature_path = os.path.join(workdir, "vavoo_signature.json")
+    with open(signature_path, 'w', encoding='utf-8') as f:
+        json.dump({"signature": "benchmark"}, f)
+    routes[VAVOO_SIGNATURE_URL] = signature_path
+    daddy_path = os.path.join(workdir, "daddy.html")
+    with open(daddy_path, 'w', encoding='utf-8') as f:
+        f.write("<html><body>")
+        for number, (name, _, _) in enumerate(entries[::10]):
+            f.write(f'<a class="card" href="/watch.php?id={1000 + number}"><div class="card__title">{name} Italy</div></a>')
+        f.write("</body></html>")
+    routes[DADDY_CHANNELS_URL] = daddy_path
+
+    with open(os.path.join(workdir, "routes.json"), 'w', encoding='utf-8') as f:
+        json.dump(routes, f)
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process. VmHWM is used when available: ru_maxrss survives
+    exec and would report the (larger) parent that started the stage process.
+    """
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_stage_process(stage, workdir):
+    """Body of the stage process: runs one stage offline and writes result.json in the work directory."""
+    function_name, outputs = STAGES[stage]
+    with open(os.path.join(workdir, "routes.json"), 'r', encoding='utf-8') as f:
+        install_network_mock(json.load(f))
+    lista.output_dir = workdir
+
+    function = getattr(lista, function_name, None) or globals()[function_name]
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    # Per-source playlists are written in background: the stage time is its critical path
+    lista.wait_m3u_file_writes()
+
+    output_bytes = {name: os.path.getsize(os.path.join(workdir, name))
+                    for name in outputs if os.path.exists(os.path.join(workdir, name))}
+    result = {
+        "wall_s": round(elapsed, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "output_bytes": output_bytes,
+        "output_total_bytes": sum(output_bytes.values()),
+    }
+    with open(os.path.join(workdir, "result.json"), 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+def run_suite(datasets, stages, repeat, verbose):
+    """Runs every stage on every dataset in a fresh copy of its work directory; the median wall time is kept."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for dataset, (document, entries) in datasets.items():
+            prepared = os.path.join(tmp, dataset)
+            prepare_workdir(prepared, document, entries)
+            results[dataset] = {}
+            for stage in stages:
+                runs = []
+                for _ in range(repeat):
+                    workdir = os.path.join(tmp, f"{dataset}-{stage}")
+                    shutil.copytree(prepared, workdir)
+                    environment = dict(os.environ, **STAGE_ENVIRONMENT, EPG_CACHE_DIR=os.path.join(workdir, ".cache", "epg"))
+                    subprocess.run([sys.executable, os.path.abspath(__file__), "_stage", stage, workdir],
+                                   env=environment, check=True,
+                                   stdout=None if verbose else subprocess.DEVNULL,
+                                   stderr=None if verbose else subprocess.DEVNULL)
+                    with open(os.path.join(workdir, "result.json"), 'r', encoding='utf-8') as f:
+                        runs.append(json.load(f))
+                    shutil.rmtree(workdir)
+                runs.sort(key=lambda run: run["wall_s"])
+                result = dict(runs[len(runs) // 2], peak_rss_mb=max(run["peak_rss_mb"] for run in runs))
+                results[dataset][stage] = result
+                print(f"  {dataset:<10} {stage:<16} {result['wall_s']:8.2f}s {result['peak_rss_mb']:8.1f} MB "
+                      f"{result['output_total_bytes'] / (1024 * 1024):8.2f} MB out")
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(previous, current):
+    """Prints the change of every metric against a previous results file."""
+    print(f"Compared with {previous.get('commit')} ({previous.get('timestamp')}):")
+    for dataset, stages in current["results"].items():
+        for stage, result in stages.items():
+            before = previous.get("results", {}).get(dataset, {}).get(stage)
+            if not before:
+                continue
+            changes = []
+            for metric in ("wall_s", "peak_rss_mb", "output_total_bytes"):
+                if before.get(metric):
+                    changes.append(f"{metric} {(result[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+            print(f"  {dataset:<10} {stage:<16} " + ", ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the lista.py EPG stages")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gzip_parser = subparsers.add_parser("gzip", help="GzipFile vs ParallelGzipWriter on synthetic XMLTV")
+    gzip_parser.add_argument("--size-mb", type=int, default=50)
+    gzip_parser.add_argument("--level", type=int, default=int(os.getenv("EPG_GZIP_LEVEL", "9")))
+    gzip_parser.add_argument("--threads", type=int, default=0, help="0 = one thread per CPU")
+
+    splice_parser = subparsers.add_parser("splice", help="ElementTree vs byte-level splice merge engine")
+    splice_parser.add_argument("--size-mb", type=int, default=50)
+    splice_parser.add_argument("--file", help="XMLTV fixture (.xml or .xml.gz, e.g. epg.xml.gz) instead of synthetic data")
+
+    lxml_parser = subparsers.add_parser("lxml", help="ElementTree vs lxml engine (byte-identical output expected)")
+    lxml_parser.add_argument("--size-mb", type=int, default=50)
+    lxml_parser.add_argument("--file", default=os.path.join(lista.output_dir, "epg.xml.gz"),
+                             help="XMLTV fixture (.xml or .xml.gz), the committed epg.xml.gz by default")
+
+    m3u_parser = subparsers.add_parser("m3u", help="M3U tokenizer vs the legacy parse_m3u_for_sorting")
+    m3u_parser.add_argument("--file", default=os.path.join(lista.output_dir, "lista.m3u"))
+    m3u_parser.add_argument("--repeat", type=int, default=200)
+
+    suite_parser = subparsers.add_parser("suite", help="Offline stage benchmarks, results saved as JSON")
+    suite_parser.add_argument("--channels", type=int, default=300, help="synthetic XMLTV channels")
+    suite_parser.add_argument("--programmes", type=int, default=150, help="synthetic programmes per channel")
+    suite_parser.add_argument("--entries", type=int, default=3000, help="synthetic M3U entries")
+    suite_parser.add_argument("--datasets", default="synthetic,fixtures", help="synthetic and/or fixtures (epg.xml.gz, lista.m3u)")
+    suite_parser.add_argument("--stages", default=",".join(STAGES))
+    suite_parser.add_argument("--repeat", type=int, default=1)
+    suite_parser.add_argument("--output", default="benchmark_results.json")
+    suite_parser.add_argument("--compare", help="previous results file to compare with")
+    suite_parser.add_argument("--verbose", action="store_true", help="show the output of the stages")
+
+    stage_parser = subparsers.add_parser("_stage")
+    stage_parser.add_argument("stage", choices=list(STAGES))
+    stage_parser.add_argument("workdir")
+
+    args = parser.parse_args()
+    if args.command == "gzip":
+        benchmark_gzip(generate_xmltv(args.size_mb), args.level, args.threads)
+    elif args.command == "splice":
+        benchmark_engines(load_fixture(args.file, args.size_mb), ["splice"])
+    elif args.command == "lxml":
+        benchmark_engines(load_fixture(args.file, args.size_mb), ["lxml"])
+    elif args.command == "m3u":
+        benchmark_m3u(args.file, args.repeat)
+    elif args.command == "_stage":
+        run_stage_process(args.stage, args.workdir)
+    elif args.command == "suite":
+        datasets = {}
+        for dataset in args.datasets.split(","):
+            if dataset == "synthetic":
+                datasets[dataset] = (generate_xmltv(channels=args.channels, programmes_per_channel=args.programmes),
+                                     generate_m3u_entries(args.entries))
+            elif dataset == "fixtures":
+                datasets[dataset] = (load_fixture(os.path.join(lista.output_dir, "epg.xml.gz"), 0),
+                                     read_m3u_entries(os.path.join(lista.output_dir, "lista.m3u")))
+        results = {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "parameters": {"channels": args.channels, "programmes": args.programmes, "entries": args.entries,
+                           "repeat": args.repeat},
+            "results": run_suite(datasets, args.stages.split(","), args.repeat, args.verbose),
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved in {args.output}")
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,12 @@ import os
 import re
 import concurrent.futures
 import json
+import marshal
+import struct
 import xml.etree.ElementTree as ET
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,44 +25,195 @@ def headers_to_extvlcopt(headers):
         vlc_opts.append(f'#EXTVLCOPT:http-{key.lower()}={value}')
     return vlc_opts
 
-def merger_playlist():
+M3U_ATTRIBUTE = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+# #EXTINF:<duration> <attributes>,<name> - the name starts at the first comma outside quoted values
+M3U_EXTINF = re.compile(r'#EXTINF:[^,"]*(?:"[^"]*"[^,"]*)*,')
+
+class M3UEntry:
+    """One playlist channel: its #EXTINF line (name and attributes), option lines (#EXTVLCOPT...) and URL."""
+
+    __slots__ = ("name", "options", "url", "extinf", "_attrs")
+
+    def __init__(self, extinf):
+        self.extinf = extinf
+        self.options = []
+        self.url = None
+        self._attrs = None
+        match = M3U_EXTINF.match(extinf)
+        self.name = (extinf[match.end():].strip() if match else "") or "NoName"
+
+    @property
+    def attrs(self):
+        """tvg-id, tvg-logo, group-title... parsed on first use (sorting only needs the name)"""
+        if self._attrs is None:
+            match = M3U_EXTINF.match(self.extinf)
+            self._attrs = dict(M3U_ATTRIBUTE.findall(self.extinf, 0, match.end() if match else len(self.extinf)))
+        return self._attrs
+
+    def lines(self):
+        return [self.extinf, *self.options, self.url]
+
+    def text(self):
+        return "\n".join(self.lines()) + "\n"
+
+def iter_m3u_entries(lines):
+    """
+    Streaming M3U tokenizer: yields an M3UEntry for every #EXTINF ... URL block
+    of an iterable of lines (an open file, a list, ...). The #EXTM3U header,
+    blank lines, comments such as '# SPORT' and entries without URL are dropped.
+    """
+    entry = None
+    for line in lines:
+        line = line.strip()
+        if line[:1] == '#':
+            if line.startswith('#EXTINF:'):
+                entry = M3UEntry(line)
+            elif entry is not None and line.startswith(('#EXT', '#KODIPROP')):
+                entry.options.append(line)
+        elif line and entry is not None:
+            entry.url = line
+            yield entry
+            entry = None
+
+def iter_playlist_entries(source, exclude_group_title=None):
+    """
+    Streams the entries of a local playlist or of a remote one (http...),
+    without holding the whole file in memory. Whole entries (EXTINF, options
+    and URL) whose group-title contains exclude_group_title are dropped.
+    """
+    if source.startswith("http"):
+        with requests.get(source, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            entries = iter_m3u_entries(response.iter_lines(decode_unicode=True))
+            yield from filter_m3u_entries(entries, exclude_group_title)
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            yield from filter_m3u_entries(iter_m3u_entries(f), exclude_group_title)
+
+def filter_m3u_entries(entries, exclude_group_title=None):
+    if not exclude_group_title:
+        return entries
+    return (entry for entry in entries if exclude_group_title not in entry.attrs.get("group-title", ""))
+
+M3U_WRITE_BATCH = 256  # entries buffered per write() call
+
+def write_m3u_playlist(output_filename, header, sections):
+    """
+    Writes the playlist as a stream: the header line, then every section (an
+    iterable of M3UEntry) separated by a blank line, M3U_WRITE_BATCH entries
+    per write. Sections are consumed lazily, so a remote playlist is copied
+    through while it downloads. The file is written to .tmp and replaced only
+    on success, so a failed download never leaves a truncated lista.m3u.
+    """
+    tmp_path = output_filename + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(header)
+            for index, entries in enumerate(sections):
+                if index:
+                    f.write("\n")
+                batch = []
+                for entry in entries:
+                    batch.append(entry.text())
+                    if len(batch) >= M3U_WRITE_BATCH:
+                        f.write("".join(batch))
+                        batch.clear()
+                f.write("".join(batch))
+        os.replace(tmp_path, output_filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_m3u_file(path, categories):
+    """Per-source playlist (vavoo.m3u, world.m3u...): a '# CATEGORY' comment before the entries of each category"""
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write("#EXTM3U\n")
+        for category, entries in categories:
+            f.write(f"\n# {category.upper()}\n")
+            f.write("".join(entry.text() for entry in entries))
+    os.replace(path + ".tmp", path)
+
+# Per-source playlists still written for compatibility, off the critical path of the merger
+M3U_FILE_WRITES = []
+M3U_FILE_WRITER = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="m3u-writer")
+
+def write_m3u_file_in_background(path, categories):
+    M3U_FILE_WRITES.append(M3U_FILE_WRITER.submit(write_m3u_file, path, categories))
+
+def wait_m3u_file_writes():
+    """Blocks until the background playlist writes are on disk (before anything reads them back)"""
+    while M3U_FILE_WRITES:
+        future = M3U_FILE_WRITES.pop(0)
+        try:
+            future.result()
+        except OSError as e:
+            print(f"[!] Error writing playlist file: {e}")
+
+def read_m3u_entries(file_path):
+    """All the entries of a local M3U file (empty list if it does not exist)."""
+    if not os.path.exists(file_path):
+        print(f"[WARNING] File not found, cannot sort: {file_path}")
+        return []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return list(iter_m3u_entries(f))
+
+def playlist_entries(playlists, file_path):
+    """
+    Entries of a per-source playlist: the records handed over in-process by the
+    stage that generated it (playlists, keyed by file name) or, for a source not
+    generated in this run, the file read back from disk.
+    """
+    name = os.path.basename(file_path)
+    if playlists and name in playlists:
+        return playlists[name]
+    return read_m3u_entries(file_path)
+
+M3U_MIN_RUN_LENGTH = 4  # a source with shorter sorted runs on average is sorted in full
+
+def m3u_sort_key(entry):
+    return entry.name.lower()
+
+def merge_sorted_m3u_entries(sources, key=m3u_sort_key):
+    """
+    Lazily merges lists of M3UEntry into one sequence ordered by key, same order
+    as a stable sort of the concatenated sources. Each source is split into its
+    ascending runs (save_as_m3u writes every category already sorted) and the
+    runs are combined with a k-way heap merge; only a source whose runs are
+    too short to be worth merging is sorted in full first.
+    """
+    import heapq
+    from operator import itemgetter
+
+    runs = []
+    for entries in sources:
+        keyed = [(key(entry), entry) for entry in entries]
+        source_runs = []
+        run_start = 0
+        for position in range(1, len(keyed)):
+            if keyed[position][0] < keyed[position - 1][0]:
+                source_runs.append((run_start, position))
+                run_start = position
+        if keyed:
+            source_runs.append((run_start, len(keyed)))
+        if len(source_runs) * M3U_MIN_RUN_LENGTH > len(keyed):
+            keyed.sort(key=itemgetter(0))
+            source_runs = [(0, len(keyed))] if keyed else []
+        runs.extend(keyed[start:end] for start, end in source_runs)
+
+    print(f"[INFO] Italian channels: {len(runs)} sorted runs merged from {len(sources)} playlists")
+    return map(itemgetter(1), heapq.merge(*runs, key=itemgetter(0)))
+
+def merger_playlist(playlists=None):
     # Code from the first script here
     # Add your "merger_playlist.py" script code into this function.
     # For example:
     print("Running merger_playlist.py...")
-    import requests
     import os
     from dotenv import load_dotenv
-    import re
-
-    def parse_m3u_for_sorting(file_path):
-        """Reads an M3U file and returns a list of tuples (channel_name, channel_lines)"""
-        channels = []
-        if not os.path.exists(file_path):
-            print(f"[WARNING] File not found, cannot sort: {file_path}")
-            return channels
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
 
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith('#EXTINF:'):
-                channel_name_match = re.search(r',(.+)', line)
-                channel_name = channel_name_match.group(1).strip() if channel_name_match else "NoName"
-                
-                # A channel can have multiple lines (e.g. #EXTVLCOPT)
-                channel_block = [line]
-                i += 1
-                while i < len(lines) and not lines[i].strip().startswith('#EXTINF:'):
-                    channel_block.append(lines[i].strip())
-                    i += 1
-                channels.append((channel_name, channel_block))
-            else:
-                i += 1
-        return channels
-        
     # Load environment variables from .env file
     load_dotenv()
 
@@ -75,102 +229,45 @@ def merger_playlist():
     url_streamed = os.path.join(output_dir, "streamed.m3u")
     url6 = "https://raw.githubusercontent.com/Brenders/Pluto-TV-Italia-M3U/main/PlutoItaly.m3u"
     
-    # Function to download or read a playlist
-    def download_playlist(source, append_params=False, exclude_group_title=None):
-        if source.startswith("http"):
-            response = requests.get(source, timeout=30)
-            response.raise_for_status()
-            playlist = response.text
-        else:
-            with open(source, 'r', encoding='utf-8') as f:
-                playlist = f.read()
-        
-        # Remove initial header
-        playlist = '\n'.join(line for line in playlist.split('\n') if not line.startswith('#EXTM3U'))
-    
-        if exclude_group_title:
-            playlist = '\n'.join(line for line in playlist.split('\n') if exclude_group_title not in line)
-
-        return playlist
-    
     # 1. Merge and sort Italian channels (Vavoo, Daddylive & MPD)
     print("Merging and sorting Italian channels (Vavoo, Daddylive & MPD)...")
-    vavoo_channels = parse_m3u_for_sorting(url_vavoo)
-    dlhd_channels = parse_m3u_for_sorting(url_dlhd)
-    mpd_channels = parse_m3u_for_sorting(url_mpd)
-    
-    all_italian_channels = vavoo_channels + dlhd_channels + mpd_channels
-    all_italian_channels.sort(key=lambda x: x[0].lower()) # Sort by channel name
+    vavoo_channels = playlist_entries(playlists, url_vavoo)
+    dlhd_channels = playlist_entries(playlists, url_dlhd)
+    mpd_channels = playlist_entries(playlists, url_mpd)
     
-    sorted_italian_playlist = ""
-    for _, channel_block in all_italian_channels:
-        sorted_italian_playlist += "\n".join(channel_block) + "\n"
+    # Sorted by channel name: the sorted runs of the three playlists are heap-merged while lista.m3u is written
+    all_italian_channels = merge_sorted_m3u_entries((vavoo_channels, dlhd_channels, mpd_channels))
 
-    # 2. Download the other playlists
+    # 2. The other playlists are streamed into lista.m3u while it is written
     print("Downloading the other playlists...")
     
     canali_daddy_flag = os.getenv("CANALI_DADDY", "no").strip().lower()
     if canali_daddy_flag == "si":
-        playlist_eventi = download_playlist(url_eventi, append_params=True)
+        playlist_eventi = iter_playlist_entries(url_eventi)
     else:
         print("[INFO] Skipping eventi_dlhd.m3u8 in merger_playlist as CANALI_DADDY is not 'si'.")
-        playlist_eventi = ""
+        playlist_eventi = ()
 
-    playlist_sportsonline = download_playlist(url_sportsonline)
-    playlist_streamed = download_playlist(url_streamed)
-    playlist_pluto = download_playlist(url6)
-    
-    # 3. Merge all playlists (with sorted Italian channels at the beginning)
-    lista = sorted_italian_playlist + "\n" + playlist_eventi + "\n" + playlist_sportsonline + "\n" + playlist_streamed + "\n" + playlist_pluto
+    playlist_sportsonline = iter_playlist_entries(url_sportsonline)
+    playlist_streamed = iter_playlist_entries(url_streamed)
+    playlist_pluto = iter_playlist_entries(url6)
     
-    # Add EPG header
-    lista = f'#EXTM3U url-tvg="https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/refs/heads/main/epg.xml"\n' + lista
-    
-    # Save the playlist
+    # 3. Write all playlists (EPG header first, sorted Italian channels at the beginning)
+    header = f'#EXTM3U url-tvg="https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/refs/heads/main/epg.xml"\n'
     output_filename = os.path.join(output_dir, "lista.m3u")
-    with open(output_filename, 'w', encoding='utf-8') as file:
-        file.write(lista)
+    write_m3u_playlist(output_filename, header, (all_italian_channels, playlist_eventi, playlist_sportsonline, playlist_streamed, playlist_pluto))
     
     print(f"Combined playlist saved in: {output_filename}")
     
 # Function for the first script (merger_playlist.py)
-def merger_playlistworld():
+def merger_playlistworld(playlists=None):
     # Code from the first script here
     # Add your "merger_playlist.py" script code into this function.
     # For example:
     print("Running merger_playlistworld.py...")
-    import requests
     import os
     from dotenv import load_dotenv
-    import re
 
-    def parse_m3u_for_sorting(file_path):
-        """Reads an M3U file and returns a list of tuples (channel_name, channel_lines)"""
-        channels = []
-        if not os.path.exists(file_path):
-            print(f"[WARNING] File not found, cannot sort: {file_path}")
-            return channels
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith('#EXTINF:'):
-                channel_name_match = re.search(r',(.+)', line)
-                channel_name = channel_name_match.group(1).strip() if channel_name_match else "NoName"
-                
-                channel_block = [line]
-                i += 1
-                while i < len(lines) and not lines[i].strip().startswith('#EXTINF:'):
-                    channel_block.append(lines[i].strip())
-                    i += 1
-                channels.append((channel_name, channel_block))
-            else:
-                i += 1
-        return channels
-        
     # Load environment variables from .env file
     load_dotenv()
 
@@ -187,64 +284,1214 @@ def merger_playlistworld():
     url5 = "https://raw.githubusercontent.com/Brenders/Pluto-TV-Italia-M3U/main/PlutoItaly.m3u"
     url_world = os.path.join(output_dir, "world.m3u")
     
-    # Function to download or read a playlist
-    def download_playlist(source, append_params=False, exclude_group_title=None):
-        if source.startswith("http"):
-            response = requests.get(source, timeout=30)
-            response.raise_for_status()
-            playlist = response.text
-        else:
-            with open(source, 'r', encoding='utf-8') as f:
-                playlist = f.read()
-        
-        # Remove initial header
-        playlist = '\n'.join(line for line in playlist.split('\n') if not line.startswith('#EXTM3U'))
-    
-        if exclude_group_title:
-            playlist = '\n'.join(line for line in playlist.split('\n') if exclude_group_title not in line)
-
-        return playlist
-    
     # 1. Merge and sort Italian channels (Vavoo, Daddylive & MPD)
     print("Merging and sorting Italian channels (Vavoo, Daddylive & MPD)...")
-    vavoo_channels = parse_m3u_for_sorting(url_vavoo)
-    dlhd_channels = parse_m3u_for_sorting(url_dlhd)
-    mpd_channels = parse_m3u_for_sorting(url_mpd)
-    
-    all_italian_channels = vavoo_channels + dlhd_channels + mpd_channels
-    all_italian_channels.sort(key=lambda x: x[0].lower()) # Sort by channel name
+    vavoo_channels = playlist_entries(playlists, url_vavoo)
+    dlhd_channels = playlist_entries(playlists, url_dlhd)
+    mpd_channels = playlist_entries(playlists, url_mpd)
     
-    sorted_italian_playlist = ""
-    for _, channel_block in all_italian_channels:
-        sorted_italian_playlist += "\n".join(channel_block) + "\n"
+    # Sorted by channel name: the sorted runs of the three playlists are heap-merged while lista.m3u is written
+    all_italian_channels = merge_sorted_m3u_entries((vavoo_channels, dlhd_channels, mpd_channels))
 
-    # 2. Download the other playlists
+    # 2. The other playlists are streamed into lista.m3u while it is written
     print("Downloading the other playlists...")
     
     canali_daddy_flag = os.getenv("CANALI_DADDY", "no").strip().lower()
     if canali_daddy_flag == "si":
-        playlist_eventi = download_playlist(url_eventi, append_params=True)
+        playlist_eventi = iter_playlist_entries(url_eventi)
     else:
         print("[INFO] Skipping eventi_dlhd.m3u8 in merger_playlistworld as CANALI_DADDY is not 'si'.")
-        playlist_eventi = ""
+        playlist_eventi = ()
 
-    playlist_sportsonline = download_playlist(url_sportsonline)
-    playlist_streamed = download_playlist(url_streamed)
-    playlist_pluto = download_playlist(url5)
-    playlist_world = download_playlist(url_world, exclude_group_title="Italy")
-    # 3. Merge all playlists
-    lista = sorted_italian_playlist + "\n" + playlist_eventi + "\n" + playlist_sportsonline + "\n" + playlist_streamed + "\n" + playlist_pluto + "\n" + playlist_world
-    
-    # Add EPG header
-    lista = f'#EXTM3U url-tvg="https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/refs/heads/main/epg.xml"\n' + lista
-    
-    # Save the playlist
+    playlist_sportsonline = iter_playlist_entries(url_sportsonline)
+    playlist_streamed = iter_playlist_entries(url_streamed)
+    playlist_pluto = iter_playlist_entries(url5)
+    if playlists and "world.m3u" in playlists:
+        playlist_world = filter_m3u_entries(playlists["world.m3u"], exclude_group_title="Italy")
+    else:
+        playlist_world = iter_playlist_entries(url_world, exclude_group_title="Italy")
+    # 3. Write all playlists (EPG header first)
+    header = f'#EXTM3U url-tvg="https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/refs/heads/main/epg.xml"\n'
     output_filename = os.path.join(output_dir, "lista.m3u")
-    with open(output_filename, 'w', encoding='utf-8') as file:
-        file.write(lista)
+    write_m3u_playlist(output_filename, header, (all_italian_channels, playlist_eventi, playlist_sportsonline, playlist_streamed, playlist_pluto, playlist_world))
     
     print(f"Combined playlist saved in: {output_filename}")
 
+# --- Streaming EPG helpers (used by epg_merger) ---
+
+# Attribute that holds the channel id for each top-level XMLTV element
+EPG_ID_ATTRIBUTES = {"channel": "id", "programme": "channel"}
+
+EPG_XML_HEADER = b"<?xml version='1.0' encoding='utf-8'?>\n<tv>\n"
+EPG_XML_FOOTER = b"</tv>\n"
+
+def clean_epg_id(value):
+    """Removes spaces from an EPG channel id and converts it to lowercase."""
+    return value.replace(" ", "").lower()
+
+def iter_epg_elements(source, tags=None):
+    """
+    Incrementally parses an XMLTV document (path or file object) and yields its
+    top-level elements (<channel>, <programme>) one at a time.
+    Each element is detached from the root as soon as the caller is done with it,
+    so memory stays proportional to a single element instead of the whole feed.
+    """
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if tags is None or elem.tag in tags:
+                yield elem
+            # Free the element (and everything parsed so far) right away
+            root.clear()
+
+EPG_SPLICE_START_TAG = re.compile(
+    rb'<(channel|programme)((?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*)\s*(/?)>')
+EPG_SPLICE_ATTRIBUTE = re.compile(rb'([^\s=/>]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+EPG_SPLICE_ENCODING = re.compile(rb'<\?xml[^>]*encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+EPG_SPLICE_REFERENCE = re.compile(r"&(#[0-9]+|#x[0-9A-Fa-f]+|amp|lt|gt|quot|apos);")
+EPG_SPLICE_ENTITIES = {"amp": "&", "lt": "<", "gt": ">", "quot": '"', "apos": "'"}
+
+class SplicedElement:
+    """
+    Top-level XMLTV element found by the splice scanner: its attributes are read
+    from the start tag and its bytes are copied through as they are, with only
+    the id/channel attribute cleaned. Children (title, desc, icon...) are parsed
+    lazily, the first time find/findtext/iter is used, unless findtext is
+    answered by `texts` (path -> text, e.g. kept by EPGProgrammeSorter).
+    """
+
+    __slots__ = ("tag", "attrib", "data", "texts", "_parsed")
+
+    def __init__(self, tag, attrib, data, texts=None):
+        self.tag = tag
+        self.attrib = attrib
+        self.data = data
+        self.texts = texts
+        self._parsed = None
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def _element(self):
+        if self._parsed is None:
+            self._parsed = ET.fromstring(self.data)
+        return self._parsed
+
+    def find(self, path):
+        return self._element().find(path)
+
+    def findtext(self, path, default=None):
+        if self.texts is not None and path in self.texts:
+            text = self.texts[path]
+            return default if text is None else text
+        return self._element().findtext(path, default)
+
+    def iter(self, tag=None):
+        return self._element().iter(tag)
+
+def splice_attribute_value(raw):
+    """
+    Value of a raw (quoted) attribute, decoded like the XML parser does: literal
+    line breaks and tabs become spaces, then entity and character references are replaced.
+    """
+    def reference(match):
+        name = match.group(1)
+        if name[:2] == "#x":
+            return chr(int(name[2:], 16))
+        if name[0] == "#":
+            return chr(int(name[1:]))
+        return EPG_SPLICE_ENTITIES[name]
+
+    value = raw[1:-1].decode("utf-8").replace("\r\n", " ").translate({9: " ", 10: " ", 13: " "})
+    return EPG_SPLICE_REFERENCE.sub(reference, value)
+
+def splice_escape_attribute(value, quote='"'):
+    """Escapes an attribute value for the given quote character, like ElementTree does."""
+    from xml.sax.saxutils import escape
+
+    entities = {'"': "&quot;", "\n": "&#10;", "\t": "&#09;", "\r": "&#13;"}
+    if quote == "'":
+        entities["'"] = "&apos;"
+    return escape(value, entities)
+
+def splice_attributes(attributes):
+    """Attribute dict of the raw attribute bytes of a start tag."""
+    return {attribute.group(1).decode(): splice_attribute_value(attribute.group(2))
+            for attribute in EPG_SPLICE_ATTRIBUTE.finditer(attributes)}
+
+def spliced_element_from_bytes(data, texts=None):
+    """SplicedElement of a serialized top-level element (e.g. a programme read back from a spill file)."""
+    start_tag = EPG_SPLICE_START_TAG.match(data)
+    return SplicedElement(start_tag.group(1).decode(), splice_attributes(start_tag.group(2)), data, texts)
+
+def iter_spliced_epg_elements(source, tags=None):
+    """
+    Byte-level alternative to iter_epg_elements (EPG_ENGINE=splice): scans the
+    feed for <channel>/<programme> boundaries, rewrites the id/channel attribute
+    and copies everything else through untouched, without building a tree.
+    Feeds that are not UTF-8 are handed to iter_epg_elements.
+    """
+    import mmap
+
+    with open(source, 'rb') as f:
+        head = f.read(256)
+        match = EPG_SPLICE_ENCODING.match(head)
+        if match and match.group(1).lower() not in (b"utf-8", b"utf8", b"us-ascii", b"ascii"):
+            yield from iter_epg_elements(source, tags)
+            return
+        if not head:
+            raise ET.ParseError(f"no element found: {source}")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with data:
+        position = 0
+        while True:
+            start_tag = EPG_SPLICE_START_TAG.search(data, position)
+            if start_tag is None:
+                return
+            tag_bytes, attributes, self_closing = start_tag.groups()
+            if self_closing:
+                end = start_tag.end()
+            else:
+                end = data.find(b"</" + tag_bytes + b">", start_tag.end())
+                if end < 0:
+                    raise ET.ParseError(f"unclosed <{tag_bytes.decode()}> at byte {start_tag.start()}: {source}")
+                end += len(tag_bytes) + 3
+            position = end
+
+            tag = tag_bytes.decode()
+            if tags is not None and tag not in tags:
+                continue
+
+            id_attribute = EPG_ID_ATTRIBUTES[tag].encode()
+            element = data[start_tag.start():end]
+            for attribute in EPG_SPLICE_ATTRIBUTE.finditer(attributes):
+                if attribute.group(1) == id_attribute:
+                    # Cleaned on the decoded value (like the other engines), then escaped again
+                    quoted = attribute.group(2)
+                    value = splice_escape_attribute(clean_epg_id(splice_attribute_value(quoted)),
+                                                    chr(quoted[0])).encode("utf-8")
+                    # Offsets of the quoted value inside the element bytes
+                    value_start = start_tag.start(2) - start_tag.start() + attribute.start(2) + 1
+                    value_end = start_tag.start(2) - start_tag.start() + attribute.end(2) - 1
+                    element = element[:value_start] + value + element[value_end:]
+                    break
+            attrib = splice_attributes(EPG_SPLICE_START_TAG.match(element).group(2))
+            yield SplicedElement(tag, attrib, element + b"\n")
+
+def iter_lxml_epg_elements(source, tags=None):
+    """
+    lxml version of iter_epg_elements (EPG_ENGINE=lxml): every top-level element
+    is freed, together with its already processed siblings, once the caller is
+    done with it (skipped tags included, or they would pile up in the tree).
+    lxml syntax errors are raised as ET.ParseError, like the stdlib parser does.
+    """
+    from lxml import etree as lxml_etree
+
+    try:
+        for _, elem in lxml_etree.iterparse(source, events=("end",), remove_comments=True, remove_pis=True,
+                                            huge_tree=True):
+            parent = elem.getparent()
+            if parent is None or parent.getparent() is not None:
+                continue
+            if tags is None or elem.tag in tags:
+                yield elem
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del parent[0]
+    except lxml_etree.XMLSyntaxError as e:
+        raise ET.ParseError(str(e)) from e
+
+def lxml_available():
+    try:
+        import lxml.etree  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def read_epg_elements(source, tags=None):
+    """
+    Top-level elements of an XMLTV file with the engine selected by EPG_ENGINE:
+    etree, lxml, splice, or auto (lxml when it is installed, etree otherwise).
+    """
+    engine = os.getenv("EPG_ENGINE", "auto").strip().lower()
+    if engine == "splice":
+        return iter_spliced_epg_elements(source, tags)
+    if engine == "lxml" or (engine == "auto" and lxml_available()):
+        if lxml_available():
+            return iter_lxml_epg_elements(source, tags)
+        print("[!] lxml is not installed, using ElementTree (pip install lxml)")
+    return iter_epg_elements(source, tags)
+
+def lxml_tostring(elem):
+    """
+    Serializes an lxml element exactly like ET.tostring(elem, encoding="utf-8"):
+    lxml writes "<a/>" and "&#9;" where ElementTree writes "<a />" and "&#09;".
+    """
+    from lxml import etree as lxml_etree
+
+    data = lxml_etree.tostring(elem, encoding="utf-8", xml_declaration=False)
+    return data.replace(b"/>", b" />").replace(b"&#9;", b"&#09;")
+
+def serialize_epg_element(elem):
+    """Cleans the id/channel attribute of a top-level EPG element and returns it as UTF-8 bytes."""
+    if isinstance(elem, SplicedElement):
+        return elem.data
+    attr_name = EPG_ID_ATTRIBUTES.get(elem.tag)
+    if attr_name and attr_name in elem.attrib:
+        elem.attrib[attr_name] = clean_epg_id(elem.attrib[attr_name])
+    # The tail seen by iterparse depends on buffering, always use a single newline
+    elem.tail = "\n"
+    if isinstance(elem, ET.Element):
+        return ET.tostring(elem, encoding="utf-8")
+    return lxml_tostring(elem)
+
+def parse_xmltv_time(value):
+    """
+    Fast conversion of an XMLTV timestamp ("20251020213000 +0200") to a UTC epoch.
+    Returns None when the value cannot be parsed.
+    """
+    try:
+        seconds = (epoch_day(value[:8]) * 86400 + int(value[8:10]) * 3600
+                   + int(value[10:12]) * 60 + int(value[12:14] or 0))
+        offset = value[14:].strip()
+        if offset:
+            offset_seconds = int(offset[1:3]) * 3600 + int(offset[3:5]) * 60
+            seconds -= offset_seconds if offset[0] == "+" else -offset_seconds
+        return seconds
+    except (ValueError, TypeError, IndexError):
+        return None
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+@lru_cache(maxsize=1024)
+def epoch_day(yyyymmdd):
+    """Number of days between 1970-01-01 and a YYYYMMDD date (cached, programmes share few dates)."""
+    return date(int(yyyymmdd[:4]), int(yyyymmdd[4:6]), int(yyyymmdd[6:8])).toordinal() - EPOCH_ORDINAL
+
+class EPGHorizon:
+    """
+    Time window applied to the merged programmes: drops everything that stopped
+    more than `past_hours` ago or starts more than `future_hours` from now,
+    and keeps count of what was dropped.
+    """
+
+    def __init__(self, past_hours, future_hours, now=None):
+        import time
+
+        now = time.time() if now is None else now
+        self.min_stop = now - past_hours * 3600
+        self.max_start = now + future_hours * 3600
+        self.dropped = 0
+        self.dropped_bytes = 0
+
+    def keep(self, element):
+        """Returns False for a programme outside the horizon (programmes with invalid times are kept)"""
+        start = parse_xmltv_time(element.get("start"))
+        if start is None:
+            return True
+        stop = parse_xmltv_time(element.get("stop"))
+        if start > self.max_start or (stop if stop is not None else start) < self.min_stop:
+            self.dropped += 1
+            return False
+        return True
+
+class EPGDedupIndex:
+    """
+    Cross-source deduplication of the merged EPG.
+    Programmes are indexed by a compact 64-bit hash of the normalized channel id
+    and the UTC start time. A first pass over all sources records, for every key,
+    the richest copy (longest description, then icon present); the merge pass
+    writes only that copy. Channels are kept on their first occurrence.
+    The first pass parses every feed twice, so it is only used with EPG_SORT=no:
+    the sorted merge compares the copies itself (EPGProgrammeSorter).
+    """
+
+    def __init__(self):
+        self.best = {}
+        self.seen_channels = set()
+
+    @staticmethod
+    def key(element):
+        import hashlib
+
+        start = element.get("start", "")
+        start_utc = parse_xmltv_time(start)
+        raw_key = f"{clean_epg_id(element.get('channel', ''))}\0{start_utc if start_utc is not None else start}"
+        return int.from_bytes(hashlib.blake2b(raw_key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    @staticmethod
+    def score(element):
+        desc_length = sum(len(desc.text or "") for desc in element.iter("desc"))
+        has_icon = element.find("icon") is not None
+        return (min(desc_length, 0xFFFFF) << 1) | has_icon
+
+    def add(self, element, uid):
+        """First pass: records a programme, returns True if an earlier copy was already indexed"""
+        key = self.key(element)
+        score = self.score(element)
+        best = self.best.get(key)
+        if best is None:
+            self.best[key] = (score, uid)
+            return False
+        if score > best[0]:
+            self.best[key] = (score, uid)
+        return True
+
+    def keep_programme(self, element, uid):
+        """Merge pass: True only for the copy selected in the first pass"""
+        best = self.best.get(self.key(element))
+        return best is None or best[1] == uid
+
+    def keep_channel(self, element):
+        """Merge pass: True for the first <channel> with a given (cleaned) id"""
+        channel_id = clean_epg_id(element.get("id", ""))
+        if channel_id in self.seen_channels:
+            return False
+        self.seen_channels.add(channel_id)
+        return True
+
+class ParallelGzipWriter:
+    """
+    pigz-style gzip writer: the stream is cut into fixed-size blocks that are
+    compressed on a thread pool (zlib releases the GIL) and written, in order,
+    as concatenated gzip members - a valid .gz for gzip, zcat and Python's gzip module.
+    At most 2 blocks per thread are in flight, so memory stays bounded.
+    """
+
+    def __init__(self, fileobj, compresslevel=9, threads=None, block_size=1024 * 1024):
+        import collections
+
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = collections.deque()
+        self.buffer = bytearray()
+
+    def _compress(self, block):
+        import gzip
+
+        return gzip.compress(block, compresslevel=self.compresslevel, mtime=0)
+
+    def _submit(self):
+        self.pending.append(self.executor.submit(self._compress, bytes(self.buffer)))
+        self.buffer.clear()
+        while len(self.pending) > self.threads * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.block_size:
+            self._submit()
+        return len(data)
+
+    def close(self):
+        if self.executor is None:
+            return
+        if self.buffer or not self.pending:
+            self._submit()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.executor.shutdown()
+        self.executor = None
+
+class EPGProgrammeSorter:
+    """
+    Groups the merged programmes by channel and orders them by start time.
+    Every source is spilled to a temporary file as a sequence of sorted runs (a
+    run ends when the channel changes or the start time goes back), so a source
+    that is already grouped and sorted is never sorted again. A source that breaks
+    into too many small runs is re-sorted on its keys only and rewritten.
+    The output is a heap-based k-way merge of the runs of each channel. The
+    source with the most programmes for a channel has precedence: slots of the
+    other sources are only kept where they do not overlap it (filling its gaps),
+    and among those the earlier source wins.
+    With `dedup`, copies of a programme (same channel and start) meet in the
+    merge and only the richest one is kept (EPGDedupIndex.score), so no extra
+    pass over the sources is needed.
+    The texts listed in `text_paths` (what the element sinks read, e.g. title
+    and desc) are spilled with every record, so the programmes handed back are
+    never parsed again.
+    """
+
+    # start, stop (UTC epochs), dedup score, length of the texts, length of the serialized element
+    RECORD = struct.Struct("<qqIII")
+    MIN_RUN_LENGTH = 4
+
+    def __init__(self, spill_dir=None, dedup=False, text_paths=()):
+        self.spill_dir = spill_dir
+        self.dedup = dedup
+        self.text_paths = tuple(text_paths)
+        self.spills = []
+        self.channel_runs = {}  # channel -> [(source index, offset, size, records)] in channel order of appearance
+        self.runs_merged = 0
+        self.overlaps = 0
+        self.source_records = []  # programmes spilled by each source
+        self.source_duplicates = defaultdict(int)  # source index -> copies dropped as duplicates
+
+    def begin_source(self):
+        import tempfile
+
+        self.spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        self.spills.append(self.spill)
+        self.source_runs = []
+        self.records = 0
+        self.run_channel = None
+        self.run_start = self.last_start = None
+        self.run_records = 0
+
+    def _end_run(self):
+        if self.run_channel is not None:
+            self.source_runs.append((self.run_channel, self.run_start, self.spill.tell() - self.run_start, self.run_records))
+
+    def add(self, element, data):
+        """Spills a (serialized) programme of the current source"""
+        channel = element.get("channel", "")
+        start = parse_xmltv_time(element.get("start"))
+        start = 0 if start is None else start
+        stop = parse_xmltv_time(element.get("stop"))
+        if channel != self.run_channel or start < self.last_start:
+            self._end_run()
+            self.run_channel = channel
+            self.run_start = self.spill.tell()
+            self.run_records = 0
+        self.last_start = start
+        self.run_records += 1
+        score = EPGDedupIndex.score(element) if self.dedup else 0
+        texts = marshal.dumps(tuple(element.findtext(path) for path in self.text_paths))
+        self.spill.write(self.RECORD.pack(start, start if stop is None else stop, score, len(texts), len(data)))
+        self.spill.write(texts)
+        self.spill.write(data)
+        self.records += 1
+
+    def _read_records(self, spill, offset, size):
+        """(start, stop, score, texts, data) of the records of a run"""
+        spill.seek(offset)
+        block = spill.read(size)
+        position = 0
+        while position < len(block):
+            start, stop, score, texts_length, length = self.RECORD.unpack_from(block, position)
+            position += self.RECORD.size
+            texts = block[position:position + texts_length]
+            position += texts_length
+            yield start, stop, score, texts, block[position:position + length]
+            position += length
+
+    def _resort_source(self):
+        """Keys-only sort of a fragmented source: one contiguous run per channel afterwards"""
+        import tempfile
+
+        # Only (channel rank, start, record offset) is kept in memory, records are copied from the spill
+        order = {}
+        index = []
+        for channel, run_offset, size, _ in self.source_runs:
+            rank = order.setdefault(channel, len(order))
+            end = run_offset + size
+            offset = run_offset
+            while offset < end:
+                self.spill.seek(offset)
+                start, _, _, texts_length, length = self.RECORD.unpack(self.spill.read(self.RECORD.size))
+                index.append((rank, start, offset))
+                offset += self.RECORD.size + texts_length + length
+        index.sort()
+
+        sorted_spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        channels = list(order)
+        runs = []
+        current_rank = run_start = None
+        run_records = 0
+        for rank, _, offset in index:
+            if rank != current_rank:
+                if current_rank is not None:
+                    runs.append((channels[current_rank], run_start, sorted_spill.tell() - run_start, run_records))
+                current_rank, run_start, run_records = rank, sorted_spill.tell(), 0
+            run_records += 1
+            self.spill.seek(offset)
+            header = self.spill.read(self.RECORD.size)
+            sorted_spill.write(header)
+            _, _, _, texts_length, length = self.RECORD.unpack(header)
+            sorted_spill.write(self.spill.read(texts_length + length))
+        if current_rank is not None:
+            runs.append((channels[current_rank], run_start, sorted_spill.tell() - run_start, run_records))
+
+        self.spill.close()
+        self.spills[-1] = self.spill = sorted_spill
+        self.source_runs = runs
+
+    def end_source(self):
+        self._end_run()
+        self.source_records.append(self.records)
+        if len(self.source_runs) * self.MIN_RUN_LENGTH > self.records:
+            self._resort_source()
+        source_index = len(self.spills) - 1
+        for channel, offset, size, records in self.source_runs:
+            self.channel_runs.setdefault(channel, []).append((source_index, offset, size, records))
+
+    def _run_stream(self, source_index, offset, size):
+        """Heap items of a run: ties on the start time keep source order, then run order"""
+        for sequence, (start, stop, score, texts, data) in enumerate(self._read_records(self.spills[source_index], offset, size)):
+            yield start, source_index, sequence, stop, score, data, texts
+
+    def _richest_copies(self, items, primary):
+        """
+        One heap item per start time: the copy with the highest score, earlier
+        items winning ties. A copy that replaces one of the primary source takes
+        its place, so it is not dropped as overlapping the primary slots, but only
+        if it ends no later than that one (or it would overlap the next primary slot).
+        The copies after the first of a group count as duplicates of their source.
+        Programmes without a valid start time (start 0) are never deduplicated.
+        """
+        group = []
+        for item in items:
+            if group and (item[0] != group[0][0] or not item[0]):
+                yield self._richest_copy(group, primary)
+                group = []
+            group.append(item)
+        if group:
+            yield self._richest_copy(group, primary)
+
+    def _richest_copy(self, group, primary):
+        for item in group[1:]:
+            self.source_duplicates[item[1]] += 1
+        best = max(group, key=lambda item: item[4])
+        primary_copies = [item for item in group if item[1] == primary]
+        if best[1] != primary and primary_copies:
+            slot = max(primary_copies, key=lambda item: item[4])
+            best = (best[0], primary) + best[2:] if best[3] <= slot[3] else slot
+        return best
+
+    def iter_programmes(self):
+        """Programmes (SplicedElements with their spilled texts) grouped by channel and ordered by start time"""
+        import bisect
+        import heapq
+        from itertools import accumulate
+
+        for runs in self.channel_runs.values():
+            self.runs_merged += len(runs)
+            counts = defaultdict(int)
+            for source_index, _, _, records in runs:
+                counts[source_index] += records
+            primary = max(counts, key=lambda source_index: (counts[source_index], -source_index))
+
+            # Slots of the primary source, to check the other sources against
+            primary_slots = list(heapq.merge(*(
+                ((start, stop) for start, stop, _, _, _ in self._read_records(self.spills[source_index], offset, size))
+                for source_index, offset, size, _ in runs if source_index == primary)))
+            primary_starts = [start for start, _ in primary_slots]
+            primary_stops = list(accumulate((stop for _, stop in primary_slots), max))
+
+            streams = [self._run_stream(source_index, offset, size) for source_index, offset, size, _ in runs]
+            items = heapq.merge(*streams)
+            if self.dedup:
+                items = self._richest_copies(items, primary)
+            other_source = other_stop = None
+            for start, source_index, _, stop, _, data, texts in items:
+                if source_index != primary:
+                    covered = bisect.bisect_left(primary_starts, stop)
+                    if (covered and primary_stops[covered - 1] > start) or \
+                            (other_source not in (None, source_index) and start < other_stop):
+                        self.overlaps += 1
+                        continue
+                    other_source, other_stop = source_index, max(stop, other_stop or stop)
+                yield spliced_element_from_bytes(data, dict(zip(self.text_paths, marshal.loads(texts))))
+
+    def close(self):
+        for spill in self.spills:
+            spill.close()
+
+EPG_SHARD_TIMEZONE = "Europe/Rome"
+
+@lru_cache(maxsize=4096)
+def epg_shard_day(epoch_hour):
+    """Europe/Rome day (YYYYMMDD) of a UTC hour; the Rome offset is a whole hour, so an hour never spans two days."""
+    from zoneinfo import ZoneInfo
+
+    return datetime.fromtimestamp(epoch_hour * 3600, ZoneInfo(EPG_SHARD_TIMEZONE)).strftime("%Y%m%d")
+
+class EPGDayShards:
+    """
+    Per-day split of the EPG being written: every programme also goes to
+    epg-YYYYMMDD.xml.gz (Europe/Rome day of its start), together with the
+    <channel> elements referenced by that day. A shard is made of gzip members:
+    the header and its channels are only known at the end and are written as the
+    first member, followed by the programmes spooled during the pass.
+    A manifest (epg_manifest.json) lists the shards with their URL and sha256.
+    """
+
+    def __init__(self, shard_dir, manifest_path, base_url="", gzip_level=9):
+        self.shard_dir = shard_dir
+        self.manifest_path = manifest_path
+        self.base_url = base_url
+        self.gzip_level = gzip_level
+        self.channels = {}
+        self.shards = {}
+
+    def _open(self, day):
+        import gzip
+        import tempfile
+
+        spool = tempfile.TemporaryFile(dir=self.shard_dir)
+        writer = gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=self.gzip_level, mtime=0)
+        shard = self.shards[day] = {"spool": spool, "writer": writer, "channels": set(), "programmes": 0}
+        return shard
+
+    def add(self, element, data):
+        if element.tag == "channel":
+            self.channels.setdefault(element.get("id", ""), data)
+            return
+        if element.tag != "programme":
+            return
+        start = parse_xmltv_time(element.get("start"))
+        if start is None:
+            return
+        day = epg_shard_day(start // 3600)
+        shard = self.shards.get(day) or self._open(day)
+        shard["writer"].write(data)
+        shard["channels"].add(element.get("channel", ""))
+        shard["programmes"] += 1
+
+    def _write_shard(self, day, shard):
+        import gzip
+        import hashlib
+        import shutil
+
+        path = os.path.join(self.shard_dir, f"epg-{day}.xml.gz")
+        shard["writer"].write(EPG_XML_FOOTER)
+        shard["writer"].close()
+        shard["spool"].seek(0)
+
+        channels = b"".join(self.channels[c] for c in sorted(shard["channels"]) if c in self.channels)
+        header = gzip.compress(EPG_XML_HEADER + channels, compresslevel=self.gzip_level, mtime=0)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(header)
+            shutil.copyfileobj(shard["spool"], f)
+        shard["spool"].close()
+
+        sha256 = hashlib.sha256()
+        with open(path + ".tmp", 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        os.replace(path + ".tmp", path)
+
+        name = os.path.basename(path)
+        return {
+            "date": f"{day[:4]}-{day[4:6]}-{day[6:]}",
+            "file": name,
+            "url": f"{self.base_url}/{name}" if self.base_url else name,
+            "sha256": sha256.hexdigest(),
+            "size": os.path.getsize(path),
+            "channels": len(shard["channels"]),
+            "programmes": shard["programmes"],
+        }
+
+    def close(self, success=True):
+        import glob
+        import time
+
+        if not success:
+            for shard in self.shards.values():
+                shard["writer"].close()
+                shard["spool"].close()
+            return
+
+        entries = [self._write_shard(day, self.shards[day]) for day in sorted(self.shards)]
+
+        # Remove the shards of days no longer covered by the EPG
+        current = {entry["file"] for entry in entries}
+        for path in glob.glob(os.path.join(self.shard_dir, "epg-[0-9]*.xml.gz")):
+            if os.path.basename(path) not in current:
+                os.remove(path)
+
+        manifest = {"generated": int(time.time()), "timezone": EPG_SHARD_TIMEZONE, "shards": entries}
+        with open(self.manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        print(f"[EPG] {len(entries)} day shards saved, manifest: {self.manifest_path}")
+
+class EPGNowNext:
+    """
+    Compact now/next snapshot of the EPG (epg_nownext.json) built during the
+    same pass: for every channel the programmes running between the run time
+    and `valid_until` (run time + window), followed by the first one after it,
+    so clients can find the current and next programme until the next run.
+    """
+
+    # Programme texts read by add()
+    TEXT_PATHS = ("title",)
+
+    def __init__(self, path, window_hours=3, now=None):
+        import time
+
+        self.path = path
+        self.now = int(time.time() if now is None else now)
+        self.valid_until = self.now + int(window_hours * 3600)
+        self.slots = defaultdict(list)
+        self.after = {}
+
+    def add(self, element, data):
+        if element.tag != "programme":
+            return
+        start = parse_xmltv_time(element.get("start"))
+        stop = parse_xmltv_time(element.get("stop"))
+        if start is None or (stop if stop is not None else start) <= self.now:
+            return
+        channel = element.get("channel", "")
+        if start < self.valid_until:
+            self.slots[channel].append((start, stop, element.findtext("title") or ""))
+        elif channel not in self.after or start < self.after[channel][0]:
+            self.after[channel] = (start, stop, element.findtext("title") or "")
+
+    def close(self, success=True):
+        if not success:
+            return
+        channels = {}
+        for channel in sorted(set(self.slots) | set(self.after)):
+            slots = sorted(self.slots.get(channel, []))
+            if channel in self.after:
+                slots.append(self.after[channel])
+            channels[channel] = [{"start": start, "stop": stop, "title": title} for start, stop, title in slots]
+        snapshot = {"generated": self.now, "valid_until": self.valid_until, "channels": channels}
+        with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(self.path + ".tmp", self.path)
+        print(f"[EPG] Now/next snapshot saved: {self.path} ({len(channels)} channels, "
+              f"{os.path.getsize(self.path) / 1024:.0f} KB)")
+
+def normalize_channel_name(name):
+    """Channel name as used for the name -> tvg-id lookup (lower-case, no spaces, no .it / HD suffixes)."""
+    name = re.sub(r"\s+", "", name.strip().lower())
+    name = re.sub(r"\.it\b", "", name)
+    name = re.sub(r"hd|fullhd", "", name)
+    return name
+
+class EPGStore:
+    """
+    Indexed SQLite copy of the merged EPG (epg.db), filled as an element sink of
+    the tee writer: channels with their normalized display-name and programmes
+    indexed by (channel, start), with start/stop as UTC epochs.
+    Query it with epg_channel_ids_by_name() and epg_now_next().
+    """
+
+    BATCH_SIZE = 5000
+    # Programme texts read by add()
+    TEXT_PATHS = ("title", "desc")
+
+    def __init__(self, db_path):
+        import sqlite3
+
+        self.db_path = db_path
+        if os.path.exists(db_path + ".tmp"):
+            os.remove(db_path + ".tmp")
+        self.conn = sqlite3.connect(db_path + ".tmp")
+        self.conn.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE channels (
+                id TEXT PRIMARY KEY,
+                display_name TEXT,
+                norm_name TEXT
+            );
+            CREATE TABLE programmes (
+                channel TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                stop INTEGER,
+                title TEXT,
+                description TEXT
+            );
+        """)
+        self.programmes = []
+
+    def add(self, element, data):
+        if element.tag == "channel":
+            display_name = element.findtext("display-name") or ""
+            self.conn.execute("INSERT OR IGNORE INTO channels VALUES (?, ?, ?)",
+                              (element.get("id", ""), display_name, normalize_channel_name(display_name)))
+        elif element.tag == "programme":
+            start = parse_xmltv_time(element.get("start"))
+            if start is None:
+                return
+            self.programmes.append((element.get("channel", ""), start, parse_xmltv_time(element.get("stop")),
+                                    element.findtext("title"), element.findtext("desc")))
+            if len(self.programmes) >= self.BATCH_SIZE:
+                self._flush()
+
+    def _flush(self):
+        self.conn.executemany("INSERT INTO programmes VALUES (?, ?, ?, ?, ?)", self.programmes)
+        self.programmes = []
+
+    def close(self, success=True):
+        if success:
+            self._flush()
+            self.conn.execute("CREATE INDEX idx_programmes_channel_start ON programmes (channel, start)")
+            self.conn.execute("CREATE INDEX idx_channels_norm_name ON channels (norm_name)")
+            self.conn.commit()
+        self.conn.close()
+        if success:
+            os.replace(self.db_path + ".tmp", self.db_path)
+            print(f"EPG database saved: {self.db_path}")
+        else:
+            os.remove(self.db_path + ".tmp")
+
+def open_epg_store(db_path):
+    """Read-only connection to epg.db, None if it does not exist."""
+    import sqlite3
+
+    if not os.path.exists(db_path):
+        return None
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+def epg_channel_ids_by_name(db_path):
+    """Maps normalized display-names to tvg-ids (later channels win, like the XML lookup did)."""
+    conn = open_epg_store(db_path)
+    if conn is None:
+        return None
+    with conn:
+        rows = conn.execute("SELECT norm_name, id FROM channels WHERE id != '' AND norm_name != '' ORDER BY rowid").fetchall()
+    conn.close()
+    return dict(rows)
+
+def epg_now_next(db_path, channel_id, now=None):
+    """
+    Current and next programme of a channel, as a list of {start, stop, title}
+    dicts (UTC epochs). The current one (start <= now < stop) is left out when
+    nothing is on air at `now`, e.g. during a gap in the schedule.
+    """
+    import time
+
+    conn = open_epg_store(db_path)
+    if conn is None:
+        return []
+    now = int(time.time()) if now is None else now
+    channel_id = clean_epg_id(channel_id)
+    with conn:
+        rows = conn.execute(
+            """SELECT start, stop, title FROM (
+                   SELECT start, stop, title FROM programmes
+                   WHERE channel = ? AND start <= ? AND stop > ? ORDER BY start DESC LIMIT 1)
+               UNION ALL
+               SELECT start, stop, title FROM (
+                   SELECT start, stop, title FROM programmes
+                   WHERE channel = ? AND start > ? ORDER BY start LIMIT 1)""",
+            (channel_id, now, now, channel_id, now)).fetchall()
+    conn.close()
+    return [{"start": start, "stop": stop, "title": title} for start, stop, title in rows]
+
+class EPGOutput:
+    """
+    Tee writer for the merged EPG: every chunk is serialized once and written to
+    the plain XML file, the gzip file and, optionally, a zstd sidecar at the same time.
+    Output goes to temporary files that replace the real ones only when the
+    `with` block completes, so a failed run never leaves a truncated EPG behind.
+    """
+
+    def __init__(self, xml_path, gz_path, gzip_level=9, zstd_path=None, zstd_level=10, element_sinks=(),
+                 gzip_threads=1):
+        self.xml_path = xml_path
+        self.gz_path = gz_path
+        self.gzip_level = gzip_level
+        # 1 = single-threaded GzipFile, 0/None = one thread per CPU
+        self.gzip_threads = gzip_threads
+        self.zstd_path = zstd_path
+        self.zstd_level = zstd_level
+        # Element-level outputs (day shards, SQLite store): add(element, data) / close(success)
+        self.element_sinks = list(element_sinks)
+        self.sinks = []
+        self.files = []
+        self.paths = []
+        self.bytes_written = 0
+
+    def _open(self, path):
+        f = open(path + ".tmp", 'wb')
+        self.files.append(f)
+        self.paths.append(path)
+        return f
+
+    def __enter__(self):
+        import gzip
+
+        self.sinks.append(self._open(self.xml_path))
+
+        # Fixed name and mtime: an unchanged EPG gives a byte-identical .gz
+        gzip_threads = self.gzip_threads or os.cpu_count() or 1
+        if gzip_threads == 1:
+            gz_file = gzip.GzipFile(filename=os.path.basename(self.xml_path), mode='wb',
+                                    fileobj=self._open(self.gz_path), compresslevel=self.gzip_level, mtime=0)
+        else:
+            gz_file = ParallelGzipWriter(self._open(self.gz_path), self.gzip_level, gzip_threads)
+        self.sinks.append(gz_file)
+
+        if self.zstd_path:
+            try:
+                import zstandard
+                compressor = zstandard.ZstdCompressor(level=self.zstd_level)
+                self.sinks.append(compressor.stream_writer(self._open(self.zstd_path)))
+            except ImportError:
+                print("[!] zstandard is not installed, zstd sidecar skipped (pip install zstandard)")
+                self.zstd_path = None
+
+        self.write(EPG_XML_HEADER)
+        return self
+
+    def write(self, data):
+        for sink in self.sinks:
+            sink.write(data)
+        self.bytes_written += len(data)
+
+    def write_element(self, element):
+        """Serializes a top-level EPG element once and writes it to every output (element sinks included)"""
+        data = serialize_epg_element(element)
+        self.write(data)
+        for element_sink in self.element_sinks:
+            element_sink.add(element, data)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.write(EPG_XML_FOOTER)
+        # Compressor sinks first, so they flush into their (still open) files
+        for sink in reversed(self.sinks):
+            sink.close()
+        for f in self.files:
+            f.close()
+        for path in self.paths:
+            if exc_type is None:
+                os.replace(path + ".tmp", path)
+                print(f"EPG file saved: {path}")
+            elif os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+        for element_sink in self.element_sinks:
+            element_sink.close(success=exc_type is None)
+        return False
+
+def new_epg_output(xml_path, element_sinks=()):
+    """Creates the EPGOutput for xml_path (+ .gz, the optional .zst sidecar, day shards and now/next) from the EPG_* settings."""
+    zstd_enabled = os.getenv("EPG_ZSTD", "no").strip().lower() == "si"
+    gzip_level = int(os.getenv("EPG_GZIP_LEVEL", "9"))
+    element_sinks = list(element_sinks)
+    if os.getenv("EPG_SHARDS", "si").strip().lower() == "si":
+        NOMEREPO = os.getenv("NOMEREPO", "").strip()
+        NOMEGITHUB = os.getenv("NOMEGITHUB", "").strip()
+        base_url = f"https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/main" if NOMEGITHUB and NOMEREPO else ""
+        xml_dir = os.path.dirname(xml_path)
+        element_sinks.append(EPGDayShards(xml_dir, os.path.join(xml_dir, "epg_manifest.json"), base_url, gzip_level))
+    if os.getenv("EPG_NOWNEXT", "si").strip().lower() == "si":
+        element_sinks.append(EPGNowNext(os.path.join(os.path.dirname(xml_path), "epg_nownext.json"),
+                                        float(os.getenv("EPG_NOWNEXT_HOURS", "3"))))
+    return EPGOutput(xml_path, xml_path + ".gz",
+                     gzip_level=gzip_level,
+                     zstd_path=xml_path + ".zst" if zstd_enabled else None,
+                     zstd_level=int(os.getenv("EPG_ZSTD_LEVEL", "10")),
+                     element_sinks=element_sinks,
+                     gzip_threads=int(os.getenv("EPG_GZIP_THREADS", "0")))
+
+def make_epg_sessions(urls, pool_size):
+    """Creates one keep-alive requests.Session per host, with a connection pool sized for concurrent downloads."""
+    from urllib.parse import urlsplit
+    from requests.adapters import HTTPAdapter
+
+    sessions = {}
+    for url in urls:
+        host = urlsplit(url).netloc
+        if host in sessions:
+            continue
+        session = requests.Session()
+        # SSL verification is disabled like for the other EPG downloads
+        session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        sessions[host] = session
+    return sessions
+
+class EPGCache:
+    """
+    On-disk cache of EPG feeds keyed by URL.
+    Stores the decompressed XML of every feed together with its ETag/Last-Modified
+    validators, so unchanged feeds are revalidated with a conditional request
+    (304 Not Modified) instead of being downloaded and decompressed again.
+    The total size is capped and the least recently used entries are evicted first.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        import threading
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        """Load the cache index, dropping entries whose body is missing"""
+        if not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except Exception as e:
+            print(f"[EPG CACHE] Error loading cache index: {e}")
+            return {}
+        return {url: entry for url, entry in index.items() if os.path.exists(self.path_for(url))}
+
+    def path_for(self, url):
+        """Path of the cached (decompressed) body of a URL"""
+        import hashlib
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".xml")
+
+    def conditional_headers(self, url):
+        """Returns the If-None-Match/If-Modified-Since headers for a cached URL"""
+        headers = {}
+        with self.lock:
+            entry = self.index.get(url)
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def touch(self, url):
+        """Marks a cached entry as used and returns its path"""
+        import time
+        with self.lock:
+            self.index[url]["last_used"] = time.time()
+        return self.path_for(url)
+
+    def store(self, url, chunks, response_headers):
+        """Streams a freshly downloaded body (iterable of chunks) to the cache with its validators and returns its path"""
+        import time
+
+        path = self.path_for(url)
+        tmp_path = path + ".tmp"
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.index[url] = {
+                "etag": response_headers.get("ETag"),
+                "last_modified": response_headers.get("Last-Modified"),
+                "size": size,
+                "last_used": time.time()
+            }
+        return path
+
+    def save(self):
+        """Evicts the least recently used entries above the size cap and saves the index"""
+        with self.lock:
+            total = sum(entry["size"] for entry in self.index.values())
+            for url, entry in sorted(self.index.items(), key=lambda item: item[1]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self.path_for(url))
+                except OSError:
+                    pass
+                total -= entry["size"]
+                del self.index[url]
+                print(f"[EPG CACHE] Evicted {url}")
+            try:
+                with open(self.index_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.index, f, indent=2)
+            except Exception as e:
+                print(f"[EPG CACHE] Error saving cache index: {e}")
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+def gunzip_chunks(chunks):
+    """
+    Incremental decompression of a stream of chunks: gzip is detected from the
+    magic bytes of the first chunk (plain XML is passed through untouched) and
+    multi-member files are supported. Bytes after a member that do not start a
+    new one (zero padding, trailing junk) are ignored, like gzip.open does for
+    zero padding. A truncated member raises EOFError, like gzip.open does.
+    Memory stays proportional to one chunk.
+    """
+    import zlib
+
+    chunks = iter(chunks)
+    first = b""
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= len(GZIP_MAGIC):
+            break
+    if not first.startswith(GZIP_MAGIC):
+        yield first
+        yield from chunks
+        return
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pending = first
+    while True:
+        while pending:
+            yield decompressor.decompress(pending)
+            pending = b""
+            # A new gzip member may start right after the end of the previous one
+            if decompressor.eof:
+                pending = decompressor.unused_data
+                while len(pending) < len(GZIP_MAGIC):
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending += chunk
+                if not pending.startswith(GZIP_MAGIC):
+                    return
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = next(chunks, None)
+        if pending is None:
+            break
+    yield decompressor.flush()
+    # A body cut short must not be cached as a complete feed
+    if not decompressor.eof:
+        raise EOFError("compressed file ended before the end-of-stream marker was reached")
+
+def fetch_epg_feed(session, url, cache, timeout=30, budget=120):
+    """
+    Downloads a .xml or .gzip EPG feed through the cache and returns the path of
+    its decompressed XML. A conditional request is sent when the feed is cached,
+    so an unchanged feed costs a single 304 response.
+    The body is decompressed on the fly and streamed to the cache file, so neither
+    the compressed nor the decompressed feed is ever held in memory.
+    `timeout` applies to the connection and to every read, `budget` caps the
+    total time spent on this source so one slow host cannot stall the stage.
+    """
+    import time
+    import zlib
+
+    deadline = time.monotonic() + budget
+
+    def timed_chunks(response):
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            if time.monotonic() > deadline:
+                raise requests.exceptions.Timeout(f"time budget of {budget}s exceeded for {url}")
+            yield chunk
+
+    with session.get(url, headers=cache.conditional_headers(url), timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            print(f"[EPG CACHE] {url} not modified, using cached copy")
+            return cache.touch(url)
+        response.raise_for_status()
+        try:
+            return cache.store(url, gunzip_chunks(timed_chunks(response)), response.headers)
+        except (zlib.error, EOFError) as e:
+            # A corrupt feed only fails its own source, like a download error
+            raise requests.exceptions.ContentDecodingError(f"invalid gzip data from {url}: {e}") from e
+
 # Function for the second script (epg_merger.py)
 def epg_merger():
     # Code from the second script here
@@ -253,10 +1500,9 @@ def epg_merger():
     print("Running epg_merger.py...")
     # The code you had in "epg_merger.py" goes here, unchanged.
     import requests
-    import gzip
     import os
     import xml.etree.ElementTree as ET
-    import io
+    from urllib.parse import urlsplit
 
     # URLs of the GZIP or XML files to process
     urls_gzip = [
@@ -267,7 +1513,7 @@ def epg_merger():
         'https://epgshare01.online/epgshare01/epg_ripper_IT1.xml.gz'
     ]
 
-    # Output file
+    # Output file (epg.xml.gz and the optional epg.xml.zst are written next to it)
     output_xml = os.path.join(output_dir, 'epg.xml')
 
     # Remote URL for it.xml
@@ -279,92 +1525,659 @@ def epg_merger():
     # Local eventi_dlhd file
     path_eventi_dlhd = os.path.join(output_dir, 'eventi_dlhd.xml')
 
-    def download_and_parse_xml(url):
-        """Downloads a .xml or .gzip file and returns the ElementTree."""
-        try:
-            # Added verify=False to ignore SSL errors
-            response = requests.get(url, timeout=30, verify=False)
-            response.raise_for_status()
+    # Concurrent download settings
+    max_workers = int(os.getenv("EPG_WORKERS", "6"))
+    request_timeout = float(os.getenv("EPG_TIMEOUT", "30"))
+    source_budget = float(os.getenv("EPG_SOURCE_BUDGET", "120"))
 
-            # Try to decompress as GZIP
-            try:
-                with gzip.open(io.BytesIO(response.content), 'rb') as f_in:
-                    xml_content = f_in.read()
-            except (gzip.BadGzipFile, OSError):
-                # Not a gzip file, use content directly
-                xml_content = response.content
+    # Time horizon of the merged programmes
+    horizon = None
+    if os.getenv("EPG_HORIZON", "si").strip().lower() == "si":
+        horizon = EPGHorizon(float(os.getenv("EPG_PAST_HOURS", "6")),
+                             float(os.getenv("EPG_FUTURE_DAYS", "3")) * 24)
 
-            return ET.ElementTree(ET.fromstring(xml_content))
-        except requests.exceptions.RequestException as e:
-            print(f"Error while downloading from {url} (SSL verification disabled): {e}")
-        except ET.ParseError as e:
-            print(f"Error parsing XML file from {url}: {e}")
-        return None
+    # Cross-source deduplication of channels and programmes
+    dedup = EPGDedupIndex() if os.getenv("EPG_DEDUP", "si").strip().lower() == "si" else None
 
-    # Create a single empty XML
-    root_finale = ET.Element('tv')
-    tree_finale = ET.ElementTree(root_finale)
+    # Conditional-request cache of the downloaded feeds
+    cache_dir = os.getenv("EPG_CACHE_DIR", "").strip() or os.path.join(output_dir, ".cache", "epg")
+    cache = EPGCache(cache_dir, int(float(os.getenv("EPG_CACHE_MAX_MB", "200")) * 1024 * 1024))
 
-    # Process each URL
-    for url in urls_gzip:
-        tree = download_and_parse_xml(url)
-        if tree is not None:
-            root = tree.getroot()
-            for element in root:
-                root_finale.append(element)
+    # Sources in merge order: (name, URL or local path, tags to keep - None keeps everything)
+    sources = [(url, url, None) for url in urls_gzip]
 
     # Check CANALI_DADDY flag before processing eventi_dlhd.xml
     canali_daddy_flag = os.getenv("CANALI_DADDY", "no").strip().lower()
     if canali_daddy_flag == "si":
         # Add eventi_dlhd.xml from local file
         if os.path.exists(path_eventi_dlhd):
-            try:
-                tree_eventi_dlhd = ET.parse(path_eventi_dlhd)
-                root_eventi_dlhd = tree_eventi_dlhd.getroot()
-                for programme in root_eventi_dlhd.findall(".//programme"):
-                    root_finale.append(programme)
-            except ET.ParseError as e:
-                print(f"Error parsing eventi_dlhd.xml: {e}")
+            sources.append(("eventi_dlhd.xml", path_eventi_dlhd, {"programme"}))
         else:
             print(f"File not found: {path_eventi_dlhd}")
     else:
         print("[INFO] Skipping eventi_dlhd.xml in epg_merger as CANALI_DADDY is not 'si'.")
 
-    # Add it.xml from remote URL
-    tree_it = download_and_parse_xml(url_it)
-    if tree_it is not None:
-        root_it = tree_it.getroot()
-        for programme in root_it.findall(".//programme"):
-            root_finale.append(programme)
+    # Add programmes of it.xml from remote URL
+    sources.append(("it.xml", url_it, {"programme"}))
+
+    # All remote feeds are downloaded concurrently (one pooled session per host),
+    # while the merge below still consumes them in the fixed order of `sources`.
+    remote_urls = [location for _, location, _ in sources if location.startswith("http")]
+    sessions = make_epg_sessions(remote_urls, max_workers)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    futures = {
+        url: executor.submit(fetch_epg_feed, sessions[urlsplit(url).netloc], url, cache, request_timeout, source_budget)
+        for url in remote_urls
+    }
+
+    # Feeds are parsed incrementally from their cached copy on disk and elements
+    # are cleaned and written as soon as they are parsed, so no merged tree is ever built.
+    # Every element is serialized once and fanned out to epg.xml, epg.xml.gz
+    # (the optional zstd sidecar, the day shards and epg.db) by the tee writer.
+    element_sinks = []
+    if os.getenv("EPG_SQLITE", "si").strip().lower() == "si":
+        element_sinks.append(EPGStore(os.path.join(output_dir, 'epg.db')))
+    epg_output = new_epg_output(output_xml, element_sinks)
+
+    # Programmes grouped by channel and ordered by start time, spilled with the texts the sinks read
+    # (with dedup, the copies of a programme are resolved while the sources are merged)
+    sorter = None
+    if os.getenv("EPG_SORT", "si").strip().lower() == "si":
+        text_paths = dict.fromkeys(path for sink in epg_output.element_sinks for path in getattr(sink, "TEXT_PATHS", ()))
+        sorter = EPGProgrammeSorter(output_dir, dedup=dedup is not None, text_paths=text_paths)
+    try:
+        # Wait for the downloads in merge order
+        parsed_sources = []
+        for name, location, tags in sources:
+            if location.startswith("http"):
+                try:
+                    parsed_sources.append((name, futures.pop(location).result(), tags))
+                except requests.exceptions.RequestException as e:
+                    print(f"Error while downloading from {location} (SSL verification disabled): {e}")
+                    print(f"Unable to download or parse {name}")
+            else:
+                parsed_sources.append((name, location, tags))
+
+        # First pass (unsorted output only): find the richest copy of every programme
+        if dedup and not sorter:
+            for source_index, (name, path, tags) in enumerate(parsed_sources):
+                programmes = duplicates = 0
+                try:
+                    for element in read_epg_elements(path, tags):
+                        if element.tag == "programme":
+                            duplicates += dedup.add(element, (source_index, programmes))
+                            programmes += 1
+                except ET.ParseError:
+                    pass  # reported by the merge pass
+                ratio = duplicates / programmes * 100 if programmes else 0
+                print(f"[EPG] {name}: {duplicates}/{programmes} duplicate programmes ({ratio:.1f}%)")
+
+        with epg_output:
+            for source_index, (name, path, tags) in enumerate(parsed_sources):
+                count = programmes = 0
+                if sorter:
+                    sorter.begin_source()
+                try:
+                    for element in read_epg_elements(path, tags):
+                        if element.tag == "programme":
+                            uid = (source_index, programmes)
+                            programmes += 1
+                            if dedup and not sorter and not dedup.keep_programme(element, uid):
+                                continue
+                            if horizon and not horizon.keep(element):
+                                horizon.dropped_bytes += len(serialize_epg_element(element))
+                                continue
+                            if sorter:
+                                # Channels are written right away, programmes after all sources
+                                sorter.add(element, serialize_epg_element(element))
+                                count += 1
+                                continue
+                        elif element.tag == "channel" and dedup and not dedup.keep_channel(element):
+                            continue
+                        epg_output.write_element(element)
+                        count += 1
+                except ET.ParseError as e:
+                    print(f"Error parsing XML file from {name}: {e}")
+                if sorter:
+                    sorter.end_source()
+                print(f"[EPG] {name}: {count} elements merged")
+
+            if sorter:
+                for element in sorter.iter_programmes():
+                    epg_output.write_element(element)
+                print(f"[EPG] Programmes ordered by channel and start: {sorter.runs_merged} sorted runs merged, "
+                      f"{sorter.overlaps} overlapping slots dropped")
+                if dedup:
+                    for source_index, (name, _, _) in enumerate(parsed_sources):
+                        programmes = sorter.source_records[source_index]
+                        duplicates = sorter.source_duplicates[source_index]
+                        ratio = duplicates / programmes * 100 if programmes else 0
+                        print(f"[EPG] {name}: {duplicates}/{programmes} duplicate programmes ({ratio:.1f}%)")
+    finally:
+        if sorter:
+            sorter.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+        for session in sessions.values():
+            session.close()
+        cache.save()
+
+    if horizon:
+        print(f"[EPG] Time horizon: {horizon.dropped} programmes dropped, "
+              f"{horizon.dropped_bytes / (1024 * 1024):.1f} MB saved")
+             
+def collect_playlist_tvg_ids(paths):
+    """Returns the set of (cleaned) tvg-ids used by the given M3U playlists."""
+    tvg_ids = set()
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"[WARNING] Playlist not found, its tvg-ids are ignored: {path}")
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for entry in iter_m3u_entries(f):
+                tvg_id = entry.attrs.get("tvg-id", "").strip()
+                if tvg_id:
+                    tvg_ids.add(clean_epg_id(tvg_id))
+    return tvg_ids
+
+# Function that prunes epg.xml to the channels used by the final playlists
+def epg_pruner():
+    print("Running epg_pruner...")
+
+    if os.getenv("EPG_PRUNE", "si").strip().lower() != "si":
+        print("[INFO] Skipping epg_pruner as EPG_PRUNE is not 'si'.")
+        return
+
+    output_xml = os.path.join(output_dir, 'epg.xml')
+    output_gz = os.path.join(output_dir, 'epg.xml.gz')
+    full_gz = os.path.join(output_dir, 'epg_full.xml.gz')
+
+    # Playlists whose tvg-ids must keep their EPG (lista.m3u also covers the remote Pluto playlist)
+    wait_m3u_file_writes()
+    playlists = [os.path.join(output_dir, name) for name in
+                 ("vavoo.m3u", "dlhd.m3u", "mpd.m3u", "eventi_dlhd.m3u", "lista.m3u")]
+    tvg_ids = collect_playlist_tvg_ids(playlists)
+    if not tvg_ids:
+        print("[WARNING] No tvg-id found in the playlists, epg.xml is left untouched.")
+        return
+    if not os.path.exists(output_xml):
+        print(f"File not found: {output_xml}")
+        return
+
+    # Keep the complete EPG alongside the pruned one (already compressed, no re-encode needed).
+    # It is copied, not moved: epg.xml.gz must survive a prune pass that fails.
+    if os.getenv("EPG_FULL", "no").strip().lower() == "si" and os.path.exists(output_gz):
+        import shutil
+        shutil.copyfile(output_gz, full_gz)
+        print(f"Full EPG saved: {full_gz}")
+
+    size_before = os.path.getsize(output_xml)
+    kept = {"channel": 0, "programme": 0}
+    dropped = {"channel": 0, "programme": 0}
+    # epg.xml is read while its replacement is written to a temporary file
+    with new_epg_output(output_xml) as epg_output:
+        for element in read_epg_elements(output_xml):
+            if element.get(EPG_ID_ATTRIBUTES.get(element.tag, "id"), "") in tvg_ids:
+                epg_output.write_element(element)
+                kept[element.tag] = kept.get(element.tag, 0) + 1
+            else:
+                dropped[element.tag] = dropped.get(element.tag, 0) + 1
+
+    print(f"[EPG] {len(tvg_ids)} tvg-ids referenced by the playlists")
+    print(f"[EPG] Kept {kept['channel']} channels and {kept['programme']} programmes, "
+          f"dropped {dropped['channel']} channels and {dropped['programme']} programmes")
+    print(f"[EPG] epg.xml: {size_before / (1024 * 1024):.1f} MB -> {os.path.getsize(output_xml) / (1024 * 1024):.1f} MB")
+
+# --- Team logo helpers (used by the eventi_dlhd generators) ---
+
+def normalize_team_name(name):
+    """Team name as used for the logo lookup (lower-case, no accents, punctuation or repeated spaces)."""
+    import unicodedata
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w]+", " ", name.lower()).split())
+
+class TeamLogoCache:
+    """
+    On-disk cache of the team logo searches (scripts/logo_cache.json), keyed by
+    normalized team name. A found logo is reused for ttl seconds, a team without
+    results is not searched again for miss_ttl seconds, and above max_entries the
+    least recently used teams are evicted. Failed searches (network errors,
+    throttling) are never cached.
+    """
+
+    def __init__(self, cache_file, ttl, miss_ttl, max_entries):
+        import threading
+
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.searches = 0
+        self.entries = self._load()
+
+    def _load(self):
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[LOGO CACHE] Error loading cache: {e}")
+            return {}
+
+    def resolve(self, team_name, search):
+        """Logo URL of a team (None if it has none): cached, or found with search(team_name) and stored"""
+        import time
+
+        key = normalize_team_name(team_name)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry["checked"] <= (self.ttl if entry["url"] else self.miss_ttl):
+                entry["last_used"] = now
+                self.hits += 1
+                print(f"[LOGO CACHE] {team_name}: {entry['url'] or 'no logo'} (cached)")
+                return entry["url"]
+        try:
+            url = search(team_name)
+        except Exception:
+            return None
+        with self.lock:
+            self.searches += 1
+            self.entries[key] = {"name": team_name, "url": url, "checked": now, "last_used": now}
+        return url
+
+    def known_logos(self):
+        """{normalized team name: logo URL} of the logos still valid in the cache"""
+        import time
+
+        now = time.time()
+        with self.lock:
+            return {key: entry["url"] for key, entry in self.entries.items()
+                    if entry["url"] and now - entry["checked"] <= self.ttl}
+
+    def save(self):
+        """Evicts the least recently used teams above max_entries and saves the cache"""
+        with self.lock:
+            print(f"[LOGO CACHE] {self.hits} logos from cache, {self.searches} searched")
+            if not self.cache_file:
+                return
+            if len(self.entries) > self.max_entries:
+                by_use = sorted(self.entries, key=lambda key: self.entries[key]["last_used"])
+                for key in by_use[:len(self.entries) - self.max_entries]:
+                    del self.entries[key]
+            try:
+                with open(self.cache_file + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f, ensure_ascii=False, indent=2)
+                os.replace(self.cache_file + ".tmp", self.cache_file)
+            except Exception as e:
+                print(f"[LOGO CACHE] Error saving cache: {e}")
+
+def open_team_logo_cache():
+    """Team logo cache configured from .env (LOGO_CACHE=no searches every team on every run)"""
+    if os.getenv("LOGO_CACHE", "si").strip().lower() != "si":
+        return TeamLogoCache(None, 0, 0, 0)
+    return TeamLogoCache(
+        os.path.join(script_dir, "logo_cache.json"),
+        ttl=float(os.getenv("LOGO_CACHE_DAYS", "30")) * 86400,
+        miss_ttl=float(os.getenv("LOGO_CACHE_MISS_HOURS", "24")) * 3600,
+        max_entries=int(os.getenv("LOGO_CACHE_MAX", "2000")))
+
+# Tokens that tell a reserve, youth or women's side from the first team (normalized names)
+TEAM_SIDE_TOKENS = {"ii": "ii", "iii": "iii", "b": "b", "primavera": "primavera", "youth": "youth",
+                    "reserves": "reserves", "women": "women", "w": "women", "femminile": "women"}
+
+def team_side(name):
+    """Side of a normalized team name: its distinguishing tokens (II, B, U19, Women...), empty for a first team"""
+    return frozenset(TEAM_SIDE_TOKENS.get(token, token) for token in name.split()
+                     if token in TEAM_SIDE_TOKENS or re.fullmatch(r"u\d{2}", token))
+
+def fuzzy_matches(queries, choices, score_cutoff):
+    """
+    For every query, {choice index: score} of the choices at least score_cutoff
+    similar (0-100, word order ignored). Only choices of the same side are
+    compared, so "Inter II" never matches "Inter" however close the names are.
+    rapidfuzz scores all the choices in one call (cdist matrix when numpy is
+    installed), difflib is the fallback.
+    """
+    choice_sides = [team_side(choice) for choice in choices]
+
+    def same_side(rows):
+        return [{index: score for index, score in row.items() if choice_sides[index] == team_side(query)}
+                for query, row in zip(queries, rows)]
+
+    try:
+        from rapidfuzz import fuzz, process
+    except ImportError:
+        import difflib
+        rows = []
+        for query in queries:
+            query = " ".join(sorted(query.split()))
+            scores = ((index, difflib.SequenceMatcher(None, query, " ".join(sorted(choice.split()))).ratio() * 100)
+                      for index, choice in enumerate(choices))
+            rows.append({index: score for index, score in scores if score >= score_cutoff})
+        return same_side(rows)
+    if not choices:
+        return [{} for _ in queries]
+    try:
+        matrix = process.cdist(queries, choices, scorer=fuzz.token_sort_ratio, score_cutoff=score_cutoff)
+    except ImportError:  # cdist needs numpy
+        return same_side([{index: score for _, score, index in
+                           process.extract(query, choices, scorer=fuzz.token_sort_ratio, limit=None,
+                                           score_cutoff=score_cutoff)}
+                          for query in queries])
+    return same_side([{index: float(score) for index, score in enumerate(row) if score} for row in matrix])
+
+class TeamLogoIndex:
+    """
+    Offline index of the logos already known: the teams with a logo in
+    logo_cache.json and the VS composites in logos/ ("Team A_vs_Team B.png").
+    Names are matched fuzzily, so "Bayern Munchen" finds "Bayern München" and
+    most events resolve without any search or rendering.
+    """
+
+    def __init__(self, team_logos, pair_logos, threshold):
+        self.team_names = list(team_logos)
+        self.team_urls = [team_logos[name] for name in self.team_names]
+        self.pair_names = [names for names, _ in pair_logos]
+        self.pair_paths = [path for _, path in pair_logos]
+        self.threshold = threshold
+
+    @classmethod
+    def build(cls, logos_dir, team_logo_cache, threshold):
+        pair_logos = []
+        if os.path.isdir(logos_dir):
+            for filename in sorted(os.listdir(logos_dir)):
+                stem, extension = os.path.splitext(filename)
+                if extension.lower() == ".png" and "_vs_" in stem:
+                    team1, team2 = stem.split("_vs_", 1)
+                    pair_logos.append(((normalize_team_name(team1), normalize_team_name(team2)),
+                                       os.path.join("logos", filename)))
+        # Content-addressed composites (vs_<hash>.png) carry their teams in the manifest
+        for filename, (team1, team2) in load_composite_manifest(logos_dir).items():
+            if os.path.exists(os.path.join(logos_dir, filename)):
+                pair_logos.append(((normalize_team_name(team1), normalize_team_name(team2)),
+                                   os.path.join("logos", filename)))
+        index = cls(team_logo_cache.known_logos(), pair_logos, threshold)
+        print(f"[LOGO INDEX] {len(index.team_names)} team logos, {len(index.pair_paths)} composites")
+        return index
+
+    def match_team(self, team_name):
+        """Logo URL of the known team most similar to team_name, None below the threshold"""
+        scores = fuzzy_matches([normalize_team_name(team_name)], self.team_names, self.threshold)[0]
+        if not scores:
+            return None
+        best = max(scores, key=scores.get)
+        print(f"[LOGO INDEX] {team_name} -> {self.team_names[best]} ({scores[best]:.0f})")
+        return self.team_urls[best]
+
+    def match_pair(self, team1, team2):
+        """Relative path of the composite whose two teams are both similar to team1 and team2 (either order)"""
+        if not self.pair_names:
+            return None
+        lefts = [left for left, _ in self.pair_names]
+        rights = [right for _, right in self.pair_names]
+        queries = [normalize_team_name(team1), normalize_team_name(team2)]
+        left_scores = fuzzy_matches(queries, lefts, self.threshold)
+        right_scores = fuzzy_matches(queries, rights, self.threshold)
+        candidates = []
+        for first, second in ((0, 1), (1, 0)):
+            candidates.extend((min(score, right_scores[second][index]), index)
+                              for index, score in left_scores[first].items() if index in right_scores[second])
+        if not candidates:
+            return None
+        score, best = max(candidates)
+        print(f"[LOGO INDEX] {team1} vs {team2} -> {self.pair_paths[best]} ({score:.0f})")
+        return self.pair_paths[best]
+
+def open_team_logo_index(team_logo_cache):
+    """Offline logo index of logos/ and logo_cache.json (LOGO_FUZZY_THRESHOLD: minimum name similarity, 0-100)"""
+    threshold = float(os.getenv("LOGO_FUZZY_THRESHOLD", "90"))
+    return TeamLogoIndex.build(os.path.join(output_dir, "logos"), team_logo_cache, threshold)
+
+# Layout of the VS composites: part of their content key, change it whenever render_vs_composite changes
+COMPOSITE_LAYOUT = b"vs-composite 300x150, logos 150x150 at 0/150, vs 100x100 at 100,25"
+COMPOSITE_MANIFEST = "composites.json"  # in logos/: composite file -> the two teams it shows
+
+def render_vs_composite(logo1, logo2, vs_image, output_path):
+    """
+    Renders the VS composite of two logos (encoded image bytes) to output_path.
+    Top-level so it can run in a worker process; vs_image is the encoded vs.png
+    (None draws a "VS" text instead).
+    """
+    import io
+    from PIL import Image, ImageDraw, ImageFont
+
+    img1 = Image.open(io.BytesIO(logo1))
+    img2 = Image.open(io.BytesIO(logo2))
+    if vs_image:
+        img_vs = Image.open(io.BytesIO(vs_image))
+        if img_vs.mode != 'RGBA':
+            img_vs = img_vs.convert('RGBA')
     else:
-        print(f"Unable to download or parse it.xml from {url_it}")
+        img_vs = Image.new('RGBA', (100, 100), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(img_vs)
+        try:
+            font = ImageFont.truetype("arial.ttf", 40)
+        except OSError:
+            font = ImageFont.load_default()
+        draw.text((30, 30), "VS", fill=(255, 0, 0), font=font)
+
+    # Logos side by side, the VS in the center overlaying both
+    img1 = img1.resize((150, 150))
+    img2 = img2.resize((150, 150))
+    img_vs = img_vs.resize((100, 100))
+    if img1.mode != 'RGBA':
+        img1 = img1.convert('RGBA')
+    if img2.mode != 'RGBA':
+        img2 = img2.convert('RGBA')
+    combined = Image.new('RGBA', (300, 150), (255, 255, 255, 0))
+    combined.paste(img1, (0, 0), img1)
+    combined.paste(img2, (150, 0), img2)
+    combined.paste(img_vs, (100, 25), img_vs)
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    combined.save(tmp_path, format="PNG")
+    os.replace(tmp_path, output_path)
+    return output_path
+
+class CompositeLogoRenderer:
+    """
+    Content-addressed VS composites in logos/: the file name is a hash of the two
+    logos (in title order) and the layout, so the same pairing is rendered once and
+    an existing composite is never re-encoded or rewritten; "B vs A" reuses an
+    existing "A vs B" instead of rendering its mirror image. Renders run in a
+    process pool (LOGO_RENDER_PROCESSES) so PIL work uses every core.
+    """
 
-    # Function to clean attributes
-    def clean_attribute(element, attr_name):
-        if attr_name in element.attrib:
-            old_value = element.attrib[attr_name]
-            new_value = old_value.replace(" ", "").lower()
-            element.attrib[attr_name] = new_value
+    def __init__(self, logos_dir, vs_path, processes):
+        import threading
+
+        self.logos_dir = logos_dir
+        self.vs_image = None
+        if os.path.exists(vs_path):
+            with open(vs_path, 'rb') as f:
+                self.vs_image = f.read()
+        self.processes = processes
+        self.pool = None
+        self.lock = threading.Lock()
+        self.renders = LookupMemo()
+        self.requested = set()  # composites used by this run
+        self.rendered = 0
+        self.manifest_path = os.path.join(logos_dir, COMPOSITE_MANIFEST)
+        self.manifest = load_composite_manifest(logos_dir)
+
+    def composite_name(self, logo1, logo2):
+        import hashlib
+
+        digest = hashlib.blake2b(digest_size=12)
+        for part in (COMPOSITE_LAYOUT, logo1, logo2, self.vs_image or b""):
+            digest.update(struct.pack("<Q", len(part)))
+            digest.update(part)
+        return f"vs_{digest.hexdigest()}.png"
+
+    def render(self, logo1, logo2, teams):
+        """Relative path (logos/...) of the composite of two logos (bytes), rendered only if missing"""
+        filename = self.composite_name(logo1, logo2)
+        output_path = os.path.join(self.logos_dir, filename)
+        with self.lock:
+            if filename not in self.requested and not os.path.exists(output_path):
+                # "B vs A" shares the composite of "A vs B" when that one already exists (or is being rendered)
+                reversed_name = self.composite_name(logo2, logo1)
+                if reversed_name in self.requested or os.path.exists(os.path.join(self.logos_dir, reversed_name)):
+                    filename, logo1, logo2, teams = reversed_name, logo2, logo1, teams[::-1]
+                    output_path = os.path.join(self.logos_dir, filename)
+            self.requested.add(filename)
+            self.manifest.setdefault(filename, list(teams))
+        if os.path.exists(output_path):
+            print(f"[✓] Using existing combined image: {output_path}")
+        else:
+            self.renders.lookup(filename, self._render, logo1, logo2, output_path)
+        return os.path.join("logos", filename)
+
+    def _render(self, logo1, logo2, output_path):
+        os.makedirs(self.logos_dir, exist_ok=True)
+        if self.processes > 1:
+            with self.lock:
+                if self.pool is None:
+                    import multiprocessing
+                    # spawn: worker processes must not inherit the locks of the lookup threads
+                    self.pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+            self.pool.submit(render_vs_composite, logo1, logo2, self.vs_image, output_path).result()
+        else:
+            render_vs_composite(logo1, logo2, self.vs_image, output_path)
+        with self.lock:
+            self.rendered += 1
+        print(f"[✓] Combined image created: {output_path}")
+
+    def close(self):
+        """Stops the worker processes and saves the manifest (only if it changed)"""
+        if self.pool is not None:
+            self.pool.shutdown()
+        with self.lock:
+            manifest = {name: teams for name, teams in sorted(self.manifest.items())
+                        if os.path.exists(os.path.join(self.logos_dir, name))}
+            print(f"[LOGO] {self.rendered} composites rendered, {self.renders.saved} duplicate renders saved")
+            if manifest == load_composite_manifest(self.logos_dir):
+                return
+            try:
+                with open(self.manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                os.replace(self.manifest_path + ".tmp", self.manifest_path)
+            except Exception as e:
+                print(f"[!] Error saving {self.manifest_path}: {e}")
 
-    # Clean channel IDs
-    for channel in root_finale.findall(".//channel"):
-        clean_attribute(channel, 'id')
+def load_composite_manifest(logos_dir):
+    path = os.path.join(logos_dir, COMPOSITE_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[!] Error loading {path}: {e}")
+        return {}
+
+def open_composite_renderer():
+    """VS composite renderer (LOGO_RENDER_PROCESSES: worker processes, 0 = one per CPU, 1 = no process pool)"""
+    processes = int(os.getenv("LOGO_RENDER_PROCESSES", "0")) or os.cpu_count() or 1
+    return CompositeLogoRenderer(os.path.join(output_dir, "logos"), os.path.join(script_dir, "vs.png"), processes)
+
+class HostRateLimiter:
+    """Spaces the requests sent to the same host by at least interval seconds, across worker threads."""
+
+    def __init__(self, interval):
+        import threading
+
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        import time
+        from urllib.parse import urlsplit
+
+        host = urlsplit(url).hostname
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class LookupMemo:
+    """
+    Run-scoped memo of the logo lookups, shared by the worker threads. The first
+    caller of a key computes it, later callers (also while it is still in flight)
+    get the same result; saved counts the lookups avoided this way.
+    """
 
-    # Clean 'channel' attributes in programmes
-    for programme in root_finale.findall(".//programme"):
-        clean_attribute(programme, 'channel')
+    def __init__(self):
+        import threading
+
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.saved = 0
+
+    def submit(self, executor, key, function, *args):
+        """Future of the lookup of key, submitted to executor only the first time"""
+        with self.lock:
+            future = self.futures.get(key)
+            if future is not None:
+                self.saved += 1
+                return future
+            future = self.futures[key] = executor.submit(function, *args)
+            return future
+
+    def lookup(self, key, function, *args):
+        """Result of the lookup of key, computed in the calling thread only the first time"""
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = concurrent.futures.Future()
+            else:
+                self.saved += 1
+        if not owner:
+            return future.result()
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
 
-    # Save the final XML file
-    with open(output_xml, 'wb') as f_out:
-        tree_finale.write(f_out, encoding='utf-8', xml_declaration=True)
-    print(f"XML file saved: {output_xml}")
+def resolve_event_logos(event_titles, search_logo_for_event, memo):
+    """
+    Logo of every event title, resolved on LOGO_WORKERS threads before the playlist
+    is written: the stage waits for its slowest lookups, not their sum. A title
+    listed on several channels is looked up once (memo).
+    """
+    import time
+
+    workers = max(1, int(os.getenv("LOGO_WORKERS", "8")))
+    started = time.time()
+    futures = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for title in event_titles:
+            futures[title] = memo.submit(executor, ("event", title), search_logo_for_event, title)
+        print(f"[🔍] Resolving logos for {len(futures)} events ({workers} workers)...")
+        logos = {}
+        for title, future in futures.items():
+            try:
+                logos[title] = future.result()
+            except Exception as e:
+                print(f"[!] Error searching for logo for '{title}': {e}")
+                logos[title] = None
+    found = sum(1 for logo in logos.values() if logo)
+    print(f"[✓] {found}/{len(logos)} event logos resolved in {time.time() - started:.1f}s, "
+          f"{memo.saved} duplicate lookups saved")
+    return logos
 
-    # Also save the GZIP file
-    output_gz = os.path.join(output_dir, 'epg.xml.gz')
-    with gzip.open(output_gz, 'wb') as f_gz:
-        tree_finale.write(f_gz, encoding='utf-8', xml_declaration=True)
-    print(f"GZIP file saved: {output_gz}")
-             
 # Function for the third script (eventi_dlhd_m3u8_generator.py)
 def eventi_dlhd_m3u8_generator_world():
     # Code from the third script here
@@ -381,7 +2194,6 @@ def eventi_dlhd_m3u8_generator_world():
     from dotenv import load_dotenv
     from PIL import Image, ImageDraw, ImageFont
     import io # Added for URL encoding
-    import time
     
     # Load environment variables from the .env file
     load_dotenv()
@@ -396,9 +2208,20 @@ def eventi_dlhd_m3u8_generator_world():
     HTTP_TIMEOUT = 10 
     session = requests.Session() 
     session.headers.update(HEADERS) 
-    # Define current_time and three_hours_in_seconds for caching logic
-    current_time = time.time()
-    three_hours_in_seconds = 3 * 60 * 60
+    # Team logos already searched in the previous runs (scripts/logo_cache.json)
+    team_logo_cache = open_team_logo_cache()
+    # Lookups already done (or in flight) in this run, by event title and by team
+    logo_memo = LookupMemo()
+    # Logos resolved offline from logos/ and logo_cache.json before any search
+    logo_index = open_team_logo_index(team_logo_cache)
+    # VS composites in logos/, named after their content
+    composite_renderer = open_composite_renderer()
+    # Logo lookups run in parallel: requests to the same host (Bing, logo sites) stay spaced out
+    host_limiter = HostRateLimiter(float(os.getenv("LOGO_HOST_INTERVAL", "0.2")))
+
+    def logo_get(url, **kwargs):
+        host_limiter.wait(url)
+        return requests.get(url, **kwargs)
     
     def clean_category_name(name): 
         # Removes HTML tags like </span> or similar
@@ -442,6 +2265,15 @@ def eventi_dlhd_m3u8_generator_world():
                 team1 = teams[0].strip()
                 team2 = teams[1].strip()
                 
+                # Composite already in logos/ for this pair (names matched fuzzily): no search, no rendering
+                known_logo_path = logo_index.match_pair(team1, team2)
+                if known_logo_path:
+                    NOMEREPO = os.getenv("NOMEREPO", "").strip()
+                    NOMEGITHUB = os.getenv("NOMEGITHUB", "").strip()
+                    if NOMEGITHUB and NOMEREPO:
+                        return f"https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/main/{known_logo_path}"
+                    return os.path.join(output_dir, known_logo_path)
+                
                 print(f"[🔍] Searching logo for Team 1: {team1}")
                 logo1_url = search_team_logo(team1)
                 
@@ -452,33 +2284,6 @@ def eventi_dlhd_m3u8_generator_world():
                 if logo1_url and logo2_url:
                     # Download the logos and the VS image
                     try:
-                        from os.path import exists, getmtime
-                        
-                        # Create the logos folder if it does not exist
-                        logos_dir = os.path.join(output_dir, "logos")
-                        os.makedirs(logos_dir, exist_ok=True)
-                        
-                        # Check if the combined image already exists and is not outdated
-                        relative_logo_path = os.path.join("logos", f"{team1}_vs_{team2}.png")
-                        absolute_output_filename = os.path.join(output_dir, relative_logo_path)
-                        if exists(absolute_output_filename):
-                            file_age = current_time - os.path.getmtime(absolute_output_filename)
-                            if file_age <= three_hours_in_seconds:
-                                print(f"[✓] Using existing combined image: {absolute_output_filename}")
-                                
-                                # Load environment variables for GitHub
-                                NOMEREPO = os.getenv("NOMEREPO", "").strip()
-                                NOMEGITHUB = os.getenv("NOMEGITHUB", "").strip()
-                                
-                                # If GitHub variables are available, return the raw GitHub URL
-                                if NOMEGITHUB and NOMEREPO:
-                                    github_raw_url = f"https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/main/{relative_logo_path}"
-                                    print(f"[✓] GitHub URL generated for existing logo: {github_raw_url}")
-                                    return github_raw_url
-                                else:
-                                    # Otherwise return the local path
-                                    return absolute_output_filename
-                        
                         # Download the logos
                         img1, img2 = None, None
                         
@@ -488,7 +2293,7 @@ def eventi_dlhd_m3u8_generator_world():
                                 logo_headers = {
                                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
                                 }
-                                response1 = requests.get(logo1_url, headers=logo_headers, timeout=10)
+                                response1 = logo_get(logo1_url, headers=logo_headers, timeout=10)
                                 response1.raise_for_status() # Check HTTP errors
                                 if 'image' in response1.headers.get('Content-Type', '').lower():
                                     img1 = Image.open(io.BytesIO(response1.content))
@@ -509,7 +2314,7 @@ def eventi_dlhd_m3u8_generator_world():
                                 logo_headers = {
                                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
                                 }
-                                response2 = requests.get(logo2_url, headers=logo_headers, timeout=10)
+                                response2 = logo_get(logo2_url, headers=logo_headers, timeout=10)
                                 response2.raise_for_status() # Check HTTP errors
                                 if 'image' in response2.headers.get('Content-Type', '').lower():
                                     img2 = Image.open(io.BytesIO(response2.content))
@@ -524,66 +2329,14 @@ def eventi_dlhd_m3u8_generator_world():
                                 print(f"[!] PIL error opening logo2 ({logo2_url}): {e_pil}")
                                 logo2_url = None
                         
-                        # Load the VS image (make sure it exists in the current directory)
-                        vs_path = os.path.join(script_dir, "vs.png")
-                        if exists(vs_path):
-                            img_vs = Image.open(vs_path)
-                            # Convert the VS image to RGBA mode if not already
-                            if img_vs.mode != 'RGBA':
-                                img_vs = img_vs.convert('RGBA')
-                        else:
-                            # Create a "VS" text image if the file doesn't exist
-                            img_vs = Image.new('RGBA', (100, 100), (255, 255, 255, 0))
-                            from PIL import ImageDraw, ImageFont
-                            draw = ImageDraw.Draw(img_vs)
-                            try:
-                                font = ImageFont.truetype("arial.ttf", 40)
-                            except:
-                                font = ImageFont.load_default()
-                            draw.text((30, 30), "VS", fill=(255, 0, 0), font=font)
-                        
                         # Proceed with combination only if both logos were loaded successfully
                         if not (img1 and img2):
                             print(f"[!] Could not load both logos as valid images for combination. Logo1 loaded: {bool(img1)}, Logo2 loaded: {bool(img2)}.")
                             raise ValueError("One or both logos were not loaded correctly.") # This will force the except below
                         
-                        # Resize images to uniform size
-                        size = (150, 150)
-                        img1 = img1.resize(size)
-                        img2 = img2.resize(size)
-                        img_vs = img_vs.resize((100, 100))
-                        
-                        # Make sure all images are in RGBA mode to support transparency
-                        if img1.mode != 'RGBA':
-                            img1 = img1.convert('RGBA')
-                        if img2.mode != 'RGBA':
-                            img2 = img2.convert('RGBA')
-                        
-                        # Create a new image with space for both logos and the VS
-                        combined_width = 300
-                        combined = Image.new('RGBA', (combined_width, 150), (255, 255, 255, 0))
-                        
-                        # Position the images with the VS overlay in the center
-                        # Place the first logo on the left
-                        combined.paste(img1, (0, 0), img1)
-                        # Place the second logo on the right
-                        combined.paste(img2, (combined_width - 150, 0), img2)
-                        
-                        # Place the VS in the center, overlaying both logos
-                        vs_x = (combined_width - 100) // 2
-                        
-                        # Create a copy of the combined image before overlaying the VS
-                        # This step is important to preserve logo details underneath
-                        combined_with_vs = combined.copy()
-                        combined_with_vs.paste(img_vs, (vs_x, 25), img_vs)
-                        
-                        # Use the image with the VS overlay
-                        combined = combined_with_vs
-                        
-                        # Save the combined image
-                        combined.save(absolute_output_filename)
-                        
-                        print(f"[✓] Combined image created: {absolute_output_filename}")
+                        # Composite named after the content of both logos and the layout: rendered once, in the process pool
+                        relative_logo_path = composite_renderer.render(response1.content, response2.content, (team1, team2))
+                        absolute_output_filename = os.path.join(output_dir, relative_logo_path)
                         
                         # Load environment variables for GitHub
                         NOMEREPO = os.getenv("NOMEREPO", "").strip()
@@ -624,7 +2377,7 @@ def eventi_dlhd_m3u8_generator_world():
                     "Connection": "keep-alive"
                 } 
                 
-                response = requests.get(search_url, headers=headers, timeout=10)
+                response = logo_get(search_url, headers=headers, timeout=10)
                 
                 if response.status_code == 200: 
                     # Method 1: Look for murl pattern (URL dell'immagine media)
@@ -667,7 +2420,7 @@ def eventi_dlhd_m3u8_generator_world():
                 "Connection": "keep-alive"
             } 
             
-            response = requests.get(search_url, headers=headers, timeout=10)
+            response = logo_get(search_url, headers=headers, timeout=10)
             
             if response.status_code == 200: 
                 # Method 1: Look for murl pattern (URL dell'immagine media)
@@ -721,6 +2474,15 @@ def eventi_dlhd_m3u8_generator_world():
         return None
 
     def search_team_logo(team_name):
+        """Logo of a single team: from logo_cache.json when known, otherwise searched online"""
+        return logo_memo.lookup(("team", normalize_team_name(team_name)),
+                                team_logo_cache.resolve, team_name, search_team_logo_indexed)
+
+    def search_team_logo_indexed(team_name):
+        """Logo of a known team with a similar name (offline index), otherwise searched online"""
+        return logo_index.match_team(team_name) or search_team_logo_online(team_name)
+
+    def search_team_logo_online(team_name):
         """
         Dedicated function to search for the logo of a single team
         """
@@ -739,7 +2501,8 @@ def eventi_dlhd_m3u8_generator_world():
                 "Connection": "keep-alive"
             } 
             
-            response = requests.get(search_url, headers=headers, timeout=10)
+            response = logo_get(search_url, headers=headers, timeout=10)
+            response.raise_for_status()  # throttling or outages are not cached as "no logo"
             
             if response.status_code == 200: 
                 # Method 1: Look for murl pattern (URL dell'immagine media)
@@ -788,6 +2551,7 @@ def eventi_dlhd_m3u8_generator_world():
                     
         except Exception as e: 
             print(f"[!] Error searching for logo for '{team_name}': {e}") 
+            raise  # not cached: the team is searched again on the next run
         
         # If nothing found, return None 
         return None
@@ -895,6 +2659,12 @@ def eventi_dlhd_m3u8_generator_world():
     def generate_m3u_from_schedule(json_file, output_file): 
         categorized_channels = extract_channels_from_json(json_file) 
 
+        # Logos are resolved before writing: one lookup per distinct event (time removed from the title)
+        event_logos = resolve_event_logos(
+            (re.sub(r'\s*\(\d{1,2}:\d{2}\)\s*$', '', ch["event_title"])
+             for channels in categorized_channels.values() for ch in channels),
+            search_logo_for_event, logo_memo)
+
         with open(output_file, "w", encoding="utf-8") as f: 
             f.write("#EXTM3U\n") 
 
@@ -918,11 +2688,9 @@ def eventi_dlhd_m3u8_generator_world():
                     event_title = ch["event_title"]  # Get the event title
                     channel_name = ch["channel_name"]
                     
-                    # Search for a logo for this event
-                    # Remove the time from the event title before searching for the logo
+                    # Logo of this event (time removed from the title), already resolved
                     clean_event_title = re.sub(r'\s*\(\d{1,2}:\d{2}\)\s*$', '', event_title)
-                    print(f"[🔍] Searching logo for: {clean_event_title}") 
-                    logo_url = search_logo_for_event(clean_event_title)
+                    logo_url = event_logos.get(clean_event_title)
                     logo_attribute = f' tvg-logo="{logo_url}"' if logo_url else ''
      
                     try: 
@@ -946,7 +2714,11 @@ def eventi_dlhd_m3u8_generator_world():
                         print(f"[!] Error on {tvg_name}: {e}") 
      
     # Run the generation when the function is called
-    generate_m3u_from_schedule(JSON_FILE, OUTPUT_FILE)
+    try:
+        generate_m3u_from_schedule(JSON_FILE, OUTPUT_FILE)
+    finally:
+        team_logo_cache.save()
+        composite_renderer.close()
 
 # Function for the third script (eventi_dlhd_m3u8_generator.py)
 def eventi_dlhd_m3u8_generator():
@@ -966,7 +2738,6 @@ def eventi_dlhd_m3u8_generator():
     from PIL import Image, ImageDraw, ImageFont
     import io
     import urllib.parse # Added for URL encoding
-    import time
 
     # Load environment variables from the .env file
     load_dotenv()
@@ -981,9 +2752,20 @@ def eventi_dlhd_m3u8_generator():
     HTTP_TIMEOUT = 10 
     session = requests.Session() 
     session.headers.update(HEADERS) 
-    # Define current_time and three_hours_in_seconds for caching logic
-    current_time = time.time()
-    three_hours_in_seconds = 3 * 60 * 60
+    # Team logos already searched in the previous runs (scripts/logo_cache.json)
+    team_logo_cache = open_team_logo_cache()
+    # Lookups already done (or in flight) in this run, by event title and by team
+    logo_memo = LookupMemo()
+    # Logos resolved offline from logos/ and logo_cache.json before any search
+    logo_index = open_team_logo_index(team_logo_cache)
+    # VS composites in logos/, named after their content
+    composite_renderer = open_composite_renderer()
+    # Logo lookups run in parallel: requests to the same host (Bing, logo sites) stay spaced out
+    host_limiter = HostRateLimiter(float(os.getenv("LOGO_HOST_INTERVAL", "0.2")))
+
+    def logo_get(url, **kwargs):
+        host_limiter.wait(url)
+        return requests.get(url, **kwargs)
     
     def clean_category_name(name): 
         # Removes HTML tags like </span> or similar 
@@ -1023,6 +2805,15 @@ Returns the image URL if found, else None."""
                 team1 = teams[0].strip()
                 team2 = teams[1].strip()
                 
+                # Composite already in logos/ for this pair (names matched fuzzily): no search, no rendering
+                known_logo_path = logo_index.match_pair(team1, team2)
+                if known_logo_path:
+                    NOMEREPO = os.getenv("NOMEREPO", "").strip()
+                    NOMEGITHUB = os.getenv("NOMEGITHUB", "").strip()
+                    if NOMEGITHUB and NOMEREPO:
+                        return f"https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/main/{known_logo_path}"
+                    return os.path.join(output_dir, known_logo_path)
+                
                 print(f"[🔍] Searching logo for Team 1: {team1}")
                 logo1_url = search_team_logo(team1)
                 
@@ -1033,33 +2824,6 @@ Returns the image URL if found, else None."""
                 if logo1_url and logo2_url:
                     # Download the logos and the VS image
                     try:
-                        from os.path import exists, getmtime
-                        
-                        # Create the logos folder if it does not exist
-                        logos_dir = os.path.join(output_dir, "logos")
-                        os.makedirs(logos_dir, exist_ok=True)
-                        
-                        # Verifica se l'immagine combinata esiste giÃÂ  e non ÃÂ¨ obsoleta
-                        relative_logo_path = os.path.join("logos", f"{team1}_vs_{team2}.png")
-                        absolute_output_filename = os.path.join(output_dir, relative_logo_path)
-                        if exists(absolute_output_filename):
-                            file_age = current_time - os.path.getmtime(absolute_output_filename)
-                            if file_age <= three_hours_in_seconds:
-                                print(f"[✓] Using existing combined image: {absolute_output_filename}")
-                                
-                                # Load environment variables for GitHub
-                                NOMEREPO = os.getenv("NOMEREPO", "").strip()
-                                NOMEGITHUB = os.getenv("NOMEGITHUB", "").strip()
-                                
-                                # If GitHub variables are available, return the raw GitHub URL
-                                if NOMEGITHUB and NOMEREPO:
-                                    github_raw_url = f"https://raw.githubusercontent.com/{NOMEGITHUB}/{NOMEREPO}/main/{relative_logo_path}"
-                                    print(f"[✓] GitHub URL generated for existing logo: {github_raw_url}")
-                                    return github_raw_url
-                                else:
-                                    # Otherwise return the local path
-                                    return absolute_output_filename
-                        
                         # Download the logos
                         img1, img2 = None, None
                         
@@ -1069,7 +2833,7 @@ Returns the image URL if found, else None."""
                                 logo_headers = {
                                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
                                 }
-                                response1 = requests.get(logo1_url, headers=logo_headers, timeout=10)
+                                response1 = logo_get(logo1_url, headers=logo_headers, timeout=10)
                                 response1.raise_for_status() # Check HTTP errors
                                 if 'image' in response1.headers.get('Content-Type', '').lower():
                                     img1 = Image.open(io.BytesIO(response1.content))
@@ -1090,7 +2854,7 @@ Returns the image URL if found, else None."""
                                 logo_headers = {
                                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
                                 }
-                                response2 = requests.get(logo2_url, headers=logo_headers, timeout=10)
+                                response2 = logo_get(logo2_url, headers=logo_headers, timeout=10)
                                 response2.raise_for_status() # Check HTTP errors
                                 if 'image' in response2.headers.get('Content-Type', '').lower():
                                     img2 = Image.open(io.BytesIO(response2.content))
@@ -1105,66 +2869,14 @@ Returns the image URL if found, else None."""
                                 print(f"[!] PIL error opening logo2 ({logo2_url}): {e_pil}")
                                 logo2_url = None
                         
-                        # Load the VS image (make sure it exists in the current directory)
-                        vs_path = os.path.join(script_dir, "vs.png")
-                        if exists(vs_path):
-                            img_vs = Image.open(vs_path)
-                            # Converti l'immagine VS in modalitÃÂ  RGBA se non lo ÃÂ¨ giÃÂ 
-                            if img_vs.mode != 'RGBA':
-                                img_vs = img_vs.convert('RGBA')
-                        else:
-                            # Create a "VS" text image if the file doesn't exist
-                            img_vs = Image.new('RGBA', (100, 100), (255, 255, 255, 0))
-                            from PIL import ImageDraw, ImageFont
-                            draw = ImageDraw.Draw(img_vs)
-                            try:
-                                font = ImageFont.truetype("arial.ttf", 40)
-                            except:
-                                font = ImageFont.load_default()
-                            draw.text((30, 30), "VS", fill=(255, 0, 0), font=font)
-                        
                         # Proceed with combination only if both logos were loaded successfully
                         if not (img1 and img2):
                             print(f"[!] Could not load both logos as valid images for combination. Logo1 loaded: {bool(img1)}, Logo2 loaded: {bool(img2)}.")
                             raise ValueError("One or both logos were not loaded correctly.") # Questo forzerÃ  l'except sottostante
                         
-                        # Ridimensiona le immagini a dimensioni uniformi
-                        size = (150, 150)
-                        img1 = img1.resize(size)
-                        img2 = img2.resize(size)
-                        img_vs = img_vs.resize((100, 100))
-                        
-                        # Assicurati che tutte le immagini siano in modalitÃÂ  RGBA per supportare la trasparenza
-                        if img1.mode != 'RGBA':
-                            img1 = img1.convert('RGBA')
-                        if img2.mode != 'RGBA':
-                            img2 = img2.convert('RGBA')
-                        
-                        # Crea una nuova immagine con spazio per entrambi i loghi e il VS
-                        combined_width = 300
-                        combined = Image.new('RGBA', (combined_width, 150), (255, 255, 255, 0))
-                        
-                        # Position the images with the VS overlay in the center
-                        # Place the first logo on the left
-                        combined.paste(img1, (0, 0), img1)
-                        # Place the second logo on the right
-                        combined.paste(img2, (combined_width - 150, 0), img2)
-                        
-                        # Place the VS in the center, overlaying both logos
-                        vs_x = (combined_width - 100) // 2
-                        
-                        # Create a copy of the combined image before overlaying the VS
-                        # Questo passaggio ÃÂ¨ importante per preservare i dettagli dei loghi sottostanti
-                        combined_with_vs = combined.copy()
-                        combined_with_vs.paste(img_vs, (vs_x, 25), img_vs)
-                        
-                        # Use the image with the VS overlay
-                        combined = combined_with_vs
-                        
-                        # Save the combined image
-                        combined.save(absolute_output_filename)
-                        
-                        print(f"[✓] Combined image created: {absolute_output_filename}")
+                        # Composite named after the content of both logos and the layout: rendered once, in the process pool
+                        relative_logo_path = composite_renderer.render(response1.content, response2.content, (team1, team2))
+                        absolute_output_filename = os.path.join(output_dir, relative_logo_path)
                         
                         # Load environment variables for GitHub
                         NOMEREPO = os.getenv("NOMEREPO", "").strip()
@@ -1205,7 +2917,7 @@ Returns the image URL if found, else None."""
                     "Connection": "keep-alive"
                 } 
                 
-                response = requests.get(search_url, headers=headers, timeout=10)
+                response = logo_get(search_url, headers=headers, timeout=10)
                 
                 if response.status_code == 200: 
                     # Method 1: Look for murl pattern (URL dell'immagine media)
@@ -1248,7 +2960,7 @@ Returns the image URL if found, else None."""
                 "Connection": "keep-alive"
             } 
             
-            response = requests.get(search_url, headers=headers, timeout=10)
+            response = logo_get(search_url, headers=headers, timeout=10)
             
             if response.status_code == 200: 
                 # Method 1: Look for murl pattern (URL dell'immagine media)
@@ -1302,6 +3014,15 @@ Returns the image URL if found, else None."""
         return None
 
     def search_team_logo(team_name):
+        """Logo of a single team: from logo_cache.json when known, otherwise searched online"""
+        return logo_memo.lookup(("team", normalize_team_name(team_name)),
+                                team_logo_cache.resolve, team_name, search_team_logo_indexed)
+
+    def search_team_logo_indexed(team_name):
+        """Logo of a known team with a similar name (offline index), otherwise searched online"""
+        return logo_index.match_team(team_name) or search_team_logo_online(team_name)
+
+    def search_team_logo_online(team_name):
         """Dedicated function to search for the logo of a single team."""
         try:
             # Prepare the search query specifica per la squadra
@@ -1318,7 +3039,8 @@ Returns the image URL if found, else None."""
                 "Connection": "keep-alive"
             } 
             
-            response = requests.get(search_url, headers=headers, timeout=10)
+            response = logo_get(search_url, headers=headers, timeout=10)
+            response.raise_for_status()  # throttling or outages are not cached as "no logo"
             
             if response.status_code == 200: 
                 # Method 1: Look for murl pattern (URL dell'immagine media)
@@ -1367,6 +3089,7 @@ Returns the image URL if found, else None."""
                     
         except Exception as e: 
             print(f"[!] Error searching for logo for '{team_name}': {e}") 
+            raise  # not cached: the team is searched again on the next run
         
         # Se non troviamo nulla, restituiamo None 
         return None
@@ -1452,6 +3175,12 @@ Returns the image URL if found, else None."""
     def generate_m3u_from_schedule(json_file, output_file): 
         categorized_channels = extract_channels_from_json(json_file) 
 
+        # Logos are resolved before writing: one lookup per distinct event (time removed from the title)
+        event_logos = resolve_event_logos(
+            (re.sub(r'\s*\(\d{1,2}:\d{2}\)\s*$', '', ch["event_title"])
+             for channels in categorized_channels.values() for ch in channels),
+            search_logo_for_event, logo_memo)
+
         with open(output_file, "w", encoding="utf-8") as f: 
             f.write("#EXTM3U\n") 
 
@@ -1475,11 +3204,9 @@ Returns the image URL if found, else None."""
                     event_title = ch["event_title"]  # Get the event title
                     channel_name = ch["channel_name"]
                     
-                    # Search for a logo for this event
-                    # Remove the time from the event title before searching for the logo
+                    # Logo of this event (time removed from the title), already resolved
                     clean_event_title = re.sub(r'\s*\(\d{1,2}:\d{2}\)\s*$', '', event_title)
-                    print(f"[🔍] Searching logo for: {clean_event_title}") 
-                    logo_url = search_logo_for_event(clean_event_title)
+                    logo_url = event_logos.get(clean_event_title)
                     logo_attribute = f' tvg-logo="{logo_url}"' if logo_url else ''
      
                     try: 
@@ -1496,14 +3223,17 @@ Returns the image URL if found, else None."""
                                 for line in vlc_opt_lines:
                                     f.write(f'{line}\n')
                             f.write(f'{stream}\n\n')
-                            print(f"[✓] ... (logo found))")) 
+                            print(f"[✓] {tvg_name}" + (f" (logo found)" if logo_url else " (no logo found)")) 
                         else: 
                             print(f"[✗] No stream found") 
                     except Exception as e: 
                         print(f"[!] Error on {tvg_name}: {e}") 
      
-    if __name__ == "__main__": 
+    try:
         generate_m3u_from_schedule(JSON_FILE, OUTPUT_FILE)
+    finally:
+        team_logo_cache.save()
+        composite_renderer.close()
 
 # Function for the fourth script (schedule_extractor.py)
 def schedule_extractor():
@@ -1944,7 +3674,7 @@ def epg_eventi_dlhd_generator_world(json_file_path, output_file_path="eventi_dlh
         keywords = ['italy', 'rai', 'italia', 'it', 'uk', 'tnt', 'usa', 'tennis channel', 'tennis stream', 'la']
         
         filtered_data = {}
-        for date, categories in json_data.items():
+        for day, categories in json_data.items():
             filtered_categories = {}
             for category, events in categories.items():
                 filtered_events = []
@@ -1987,7 +3717,7 @@ def epg_eventi_dlhd_generator_world(json_file_path, output_file_path="eventi_dlh
                     filtered_categories[category] = filtered_events
             
             if filtered_categories:
-                filtered_data[date] = filtered_categories
+                filtered_data[day] = filtered_categories
         
         return filtered_data
     
@@ -2214,7 +3944,7 @@ def epg_eventi_dlhd_generator(json_file_path, output_file_path="eventi_dlhd.xml"
         keywords = ['italy', 'rai', 'italia', 'it']
         
         filtered_data = {}
-        for date, categories in json_data.items():
+        for day, categories in json_data.items():
             filtered_categories = {}
             for category, events in categories.items():
                 filtered_events = []
@@ -2241,7 +3971,7 @@ def epg_eventi_dlhd_generator(json_file_path, output_file_path="eventi_dlhd.xml"
                     filtered_categories[category] = filtered_events
             
             if filtered_categories:
-                filtered_data[date] = filtered_categories
+                filtered_data[day] = filtered_categories
         
         return filtered_data
     
@@ -2468,12 +4198,6 @@ def italy_channels():
         cleaned_name = re.sub(r'\s*\.(a|b|c|s|d|e|f|g|h|i|j|k|l|m|n|o|p|q|r|t|u|v|w|x|y|z)\s*$', '', name, flags=re.IGNORECASE)
         return cleaned_name.strip()
 
-    def normalize_channel_name(name):
-        name = re.sub(r"\s+", "", name.strip().lower())
-        name = re.sub(r"\.it\b", "", name)
-        name = re.sub(r"hd|fullhd", "", name)
-        return name
-
     def fetch_logos():
         return {
             "sky uno": "https://raw.githubusercontent.com/tv-logo/tv-logos/main/countries/italy/sky-uno-it.png",
@@ -2882,11 +4606,16 @@ def italy_channels():
 
     def create_tvg_id_map(epg_file="epg.xml"):
         """Legge un file EPG XML e mappa i nomi dei canali normalizzati ai loro tvg-id."""
+        # Usa l'indice SQLite creato da epg_merger, se presente, invece di rileggere tutto l'XML
+        try:
+            tvg_id_map = epg_channel_ids_by_name(os.path.join(os.path.dirname(epg_file), "epg.db"))
+            if tvg_id_map is not None:
+                return tvg_id_map
+        except Exception as e:
+            print(f"Errore nella lettura di epg.db, uso {epg_file}: {e}")
         tvg_id_map = {}
         try:
-            tree = ET.parse(epg_file)
-            root = tree.getroot()
-            for channel in root.findall('.//channel'):
+            for channel in read_epg_elements(epg_file, {"channel"}):
                 tvg_id = channel.get('id')
                 display_name = channel.find('display-name').text
                 if tvg_id and display_name:
@@ -3003,57 +4732,60 @@ def italy_channels():
                     "tvg_id": tvg_id
                 })
 
-        # Salva nel file M3U
-        with open(os.path.join(output_dir, filename), "w", encoding="utf-8") as f:
-            f.write("#EXTM3U\n")
-            for category, channel_list in channels_by_category.items():
-                channel_list.sort(key=lambda x: x["name"].lower())
+        # Voci M3U per categoria: passate direttamente al merger, il file viene scritto in background
+        categories = []
+        for category, channel_list in channels_by_category.items():
+            channel_list.sort(key=lambda x: x["name"].lower())
+            
+            # Gestione dei canali duplicati (aggiungi suffisso numerico)
+            name_count = {}
+            url_by_name = {}
+            # Prima passata: conta le occorrenze dei nomi e memorizza gli URL
+            for ch in channel_list:
+                name = ch["name"]
+                url = ch["url"]
+                if name not in name_count:
+                    name_count[name] = 1
+                    url_by_name[name] = [url]
+                else:
+                    name_count[name] += 1
+                    url_by_name[name].append(url)
+
+            # Seconda passata: rinomina i canali duplicati con URL diversi
+            for ch in channel_list:
+                name = ch["name"]
+                url = ch["url"]
+                # Se ci sono più canali con lo stesso nome ma URL diversi
+                if name_count[name] > 1 and len(set(url_by_name[name])) > 1:
+                    # Trova l'indice di questo URL nell'elenco degli URL per questo nome
+                    idx = url_by_name[name].index(url) + 1
+                    # Modifica il nome solo se non è già stato modificato
+                    if not name.endswith(f"({idx})"):
+                        ch["name"] = f"{name} ({idx})"
+
+            entries = []
+            for ch in channel_list:
+                name = ch["name"]
+                url = ch["url"]
                 
-                # Gestione dei canali duplicati (aggiungi suffisso numerico)
-                name_count = {}
-                url_by_name = {}
-                # Prima passata: conta le occorrenze dei nomi e memorizza gli URL
-                for ch in channel_list:
-                    name = ch["name"]
-                    url = ch["url"]
-                    if name not in name_count:
-                        name_count[name] = 1
-                        url_by_name[name] = [url]
-                    else:
-                        name_count[name] += 1
-                        url_by_name[name].append(url)
-
-                # Seconda passata: rinomina i canali duplicati con URL diversi
-                for ch in channel_list:
-                    name = ch["name"]
-                    url = ch["url"]
-                    # Se ci sono più canali con lo stesso nome ma URL diversi
-                    if name_count[name] > 1 and len(set(url_by_name[name])) > 1:
-                        # Trova l'indice di questo URL nell'elenco degli URL per questo nome
-                        idx = url_by_name[name].index(url) + 1
-                        # Modifica il nome solo se non è già stato modificato
-                        if not name.endswith(f"({idx})"):
-                            ch["name"] = f"{name} ({idx})"
-
-                f.write(f"\n# {category.upper()}\n")
-                for ch in channel_list:
-                    name = ch["name"]
-                    url = ch["url"]
-                    
-                    # Usa logo e tvg_id pre-calcolati
-                    logo = ch.get("logo", "")
-                    tvg_id = ch.get("tvg_id", "")
-                    
-                    f.write(f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-logo="{logo}" group-title="{category}",{name}\n')
-                    
-                    # Add EXTHTTP headers for daddy channels (excluding .php)
-                    if "ava.karmakurama.com" in url and not url.endswith('.php'):
-                        daddy_headers = {"User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_7 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.0 Mobile/15E148 Safari/604.1", "Referrer": "https://ava.karmakurama.com/", "Origin": "https://ava.karmakurama.com"}
-                        vlc_opt_lines = headers_to_extvlcopt(daddy_headers)
-                        for line in vlc_opt_lines:
-                            f.write(f'{line}\n')
-                    
-                    f.write(f'{url}\n')
+                # Usa logo e tvg_id pre-calcolati
+                logo = ch.get("logo", "")
+                tvg_id = ch.get("tvg_id", "")
+                
+                entry = M3UEntry(f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-logo="{logo}" group-title="{category}",{name}'.strip())
+                
+                # Add EXTHTTP headers for daddy channels (excluding .php)
+                if "ava.karmakurama.com" in url and not url.endswith('.php'):
+                    daddy_headers = {"User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_7 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/18.0 Mobile/15E148 Safari/604.1", "Referrer": "https://ava.karmakurama.com/", "Origin": "https://ava.karmakurama.com"}
+                    vlc_opt_lines = headers_to_extvlcopt(daddy_headers)
+                    entry.options.extend(vlc_opt_lines)
+                
+                entry.url = url.strip()
+                if entry.url:
+                    entries.append(entry)
+            categories.append((category, entries))
+
+        write_m3u_file_in_background(os.path.join(output_dir, filename), categories)
 
         print(f"Playlist M3U salvata in: {os.path.join(output_dir, filename)}")
         print(f"Totale canali Vavoo: {len(channels)}")
@@ -3062,6 +4794,7 @@ def italy_channels():
         print(f"Totale canali per categoria:")
         for category, channel_list in channels_by_category.items():
             print(f" {category}: {len(channel_list)} canali")
+        return [entry for _, entries in categories for entry in entries]
 
     def get_stream_from_channel_id(channel_id):
         """Risolve lo stream URL per un canale Daddylive dato il suo ID."""
@@ -3145,40 +4878,42 @@ def italy_channels():
         
         return channels
 
-    if __name__ == "__main__":
-        # 1. Canali da sorgenti Vavoo (JSON)
-        print("\n--- Fetching canali da sorgenti Vavoo (JSON) ---")
-        channels = get_channels()
-        print(f"Trovati {len(channels)} canali Vavoo.")
-        
-        # 2. Canali dalla pagina HTML di Daddylive (se abilitato)
-        daddylive_channels = None
-        if CANALI_DADDY:
-            print("\n--- Fetching canali da Daddylive (HTML) ---")
-            daddy_json_url = f"{LINK_DADDY.rstrip('/')}/daddy.json"
-            daddylive_channels = fetch_channels_from_daddy_json(daddy_json_url)
-
-            # Aggiungi manualmente il canale DAZN (ID 877) se non è già presente
-            if not any(item[1] and 'id=877' in item[1] for item in daddylive_channels):
-                print("[INFO] Aggiunta manuale del canale DAZN (ID: 877)...")
-                # Usa il link .php come richiesto
-                stream_url_877 = get_stream_from_channel_id("877")
-                if stream_url_877:
-                    daddylive_channels.append(("DAZN Italy (D)", stream_url_877))
-                    print("[✓] Canale DAZN (ID: 877) aggiunto con successo.")
-
-            print(f"Trovati {len(daddylive_channels)} canali Daddylive.")
-        else:
-            print("\n--- Canali Daddylive disabilitati (CANALI_DADDY=no) ---")
-        
-        # 3. Crea la playlist M3U
-        print("\n--- Creazione playlist M3U ---")
-        # Salva i canali Vavoo
-        save_as_m3u(channels, filename="vavoo.m3u")
-        
-        # Salva i canali Daddylive se presenti
-        if daddylive_channels:
-            save_as_m3u([], daddylive_channels=daddylive_channels, filename="dlhd.m3u")
+    # 1. Canali da sorgenti Vavoo (JSON)
+    print("\n--- Fetching canali da sorgenti Vavoo (JSON) ---")
+    channels = get_channels()
+    print(f"Trovati {len(channels)} canali Vavoo.")
+    
+    # 2. Canali dalla pagina HTML di Daddylive (se abilitato)
+    daddylive_channels = None
+    if CANALI_DADDY:
+        print("\n--- Fetching canali da Daddylive (HTML) ---")
+        daddy_json_url = f"{LINK_DADDY.rstrip('/')}/daddy.json"
+        daddylive_channels = fetch_channels_from_daddy_json(daddy_json_url)
+
+        # Aggiungi manualmente il canale DAZN (ID 877) se non è già presente
+        if not any(item[1] and 'id=877' in item[1] for item in daddylive_channels):
+            print("[INFO] Aggiunta manuale del canale DAZN (ID: 877)...")
+            # Usa il link .php come richiesto
+            stream_url_877 = get_stream_from_channel_id("877")
+            if stream_url_877:
+                daddylive_channels.append(("DAZN Italy (D)", stream_url_877))
+                print("[✓] Canale DAZN (ID: 877) aggiunto con successo.")
+
+        print(f"Trovati {len(daddylive_channels)} canali Daddylive.")
+    else:
+        print("\n--- Canali Daddylive disabilitati (CANALI_DADDY=no) ---")
+    
+    # 3. Crea la playlist M3U
+    print("\n--- Creazione playlist M3U ---")
+    # Voci delle playlist per il merger, indicizzate per nome file (i file sono scritti in background)
+    playlists = {}
+    # Salva i canali Vavoo
+    playlists["vavoo.m3u"] = save_as_m3u(channels, filename="vavoo.m3u")
+    
+    # Salva i canali Daddylive se presenti
+    if daddylive_channels:
+        playlists["dlhd.m3u"] = save_as_m3u([], daddylive_channels=daddylive_channels, filename="dlhd.m3u")
+    return playlists
     
 # Funzione per il settimo script (world_channels_generator.py)
 def world_channels_generator():
@@ -3276,26 +5011,28 @@ def world_channels_generator():
                     channels_by_category[category] = []
                 channels_by_category[category].append((name, url))
         
-        with open(os.path.join(output_dir, filename), "w", encoding="utf-8") as f:
-            f.write("#EXTM3U\n")
-            
-            # Scrivi i canali raggruppati per categoria
-            for category, channel_list in channels_by_category.items():
-                # Aggiungi un commento per la categoria
-                f.write(f"\n# {category.upper()}\n")
-                
-                for name, url in channel_list:
-                    f.write(f'#EXTINF:-1 group-title="{category}",{name}\n{url}\n')
+        # Voci raggruppate per categoria: passate direttamente al merger, il file viene scritto in background
+        categories = []
+        for category, channel_list in channels_by_category.items():
+            entries = []
+            for name, url in channel_list:
+                entry = M3UEntry(f'#EXTINF:-1 group-title="{category}",{name}'.strip())
+                entry.url = url.strip()
+                if entry.url:
+                    entries.append(entry)
+            categories.append((category, entries))
+
+        write_m3u_file_in_background(os.path.join(output_dir, filename), categories)
         
         print(f"Playlist M3U salvata in: {os.path.join(output_dir, filename)}")
         print(f"Canali organizzati in {len(channels_by_category)} categorie:")
         for category, channel_list in sorted(channels_by_category.items()):
             print(f"  - {category}: {len(channel_list)} canali")
+        return [entry for _, entries in categories for entry in entries]
     
-    if __name__ == "__main__":
-        channels = get_channels()
-        print(f"Trovati {len(channels)} canali. Creo la playlist M3U con i link proxy...")
-        save_as_m3u(channels) 
+    channels = get_channels()
+    print(f"Trovati {len(channels)} canali. Creo la playlist M3U con i link proxy...")
+    return {"world.m3u": save_as_m3u(channels)}
 
 def sportsonline():
     import requests
@@ -3525,9 +5262,10 @@ def main():
             print(f"Errore durante l'esecuzione di epg_merger: {e}")
             return
 
-        # Canali Italia
+        # Canali Italia (le voci passano direttamente al merger finale)
+        italy_playlists = {}
         try:
-            italy_channels()
+            italy_playlists = italy_channels() or {}
         except Exception as e:
             print(f"Errore durante l'esecuzione di italy_channels: {e}")
             return
@@ -3541,10 +5279,10 @@ def main():
         # Canali World e Merge finale
         try:
             if world_flag == "si":
-                world_channels_generator()
-                merger_playlistworld()
+                world_playlists = world_channels_generator() or {}
+                merger_playlistworld({**italy_playlists, **world_playlists})
             elif world_flag == "no":
-                merger_playlist()
+                merger_playlist(italy_playlists)
             else:
                 print(f"Valore WORLD non valido: '{world_flag}'. Usa 'si' o 'no'.")
                 return
@@ -3552,9 +5290,17 @@ def main():
             print(f"Errore nella fase finale: {e}")
             return
 
+        # EPG limitata ai canali presenti nelle playlist
+        try:
+            epg_pruner()
+        except Exception as e:
+            print(f"Errore durante l'esecuzione di epg_pruner: {e}")
+            return
+
         print("Tutti gli script sono stati eseguiti correttamente!")
     finally:
-        pass  # save_daddy_cache() RIMOSSO: non più definita né necessaria
+        # save_daddy_cache() RIMOSSO: non più definita né necessaria
+        wait_m3u_file_writes()  # vavoo.m3u, dlhd.m3u e world.m3u scritti in background
         remover_cache() # Aggiunta pulizia cache alla fine
 
 if __name__ == "__main__":